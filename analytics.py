@@ -0,0 +1,88 @@
+import re
+from collections import Counter
+from datetime import date, timedelta
+
+# Pure functions over per-thread day arrays: one byte per day from `start`, 0 empty / 1 hit / 2 miss
+# (the same codes as SquareStore). All scans are bytes.count / regex over the whole array.
+HIT = 1
+NON_HIT_RUN = {}
+
+def _separator(tolerance):
+    # two hits chain when they are <= tolerance days apart, i.e. fewer than `tolerance` non-hit days between them
+    if tolerance not in NON_HIT_RUN:
+        NON_HIT_RUN[tolerance] = re.compile(b'[^\\x01]{%d,}' % tolerance)
+    return NON_HIT_RUN[tolerance]
+
+def streaks(days, tolerance):
+    pieces = [p for p in _separator(tolerance).split(days) if HIT in p]
+    lengths = [p.count(HIT) for p in pieces]
+    trailing = len(days) - len(days.rstrip(b'\x00\x02'))
+    return {
+        'chains': len(lengths),
+        'longest': max(lengths, default=0),
+        'current': lengths[-1] if lengths and trailing <= tolerance else 0,
+        'hits': days.count(HIT),
+    }
+
+def _period_bounds(cadence, start, end):
+    # [(bucket label, first day, first day of next period)] for every cadence period overlapping start..end;
+    # weeks are bucketed into the month of their Monday
+    periods = []
+    if cadence in ('weekly', '3x_week'):
+        p = start - timedelta(days=start.weekday())
+        while p <= end:
+            nxt = p + timedelta(days=7)
+            periods.append((p.strftime('%Y-%m'), p, nxt))
+            p = nxt
+    elif cadence in ('monthly', 'quarterly', 'yearly'):
+        step = {'monthly': 1, 'quarterly': 3, 'yearly': 12}[cadence]
+        p = date(start.year, 1 if step == 12 else ((start.month - 1) // step) * step + 1, 1)
+        while p <= end:
+            m = p.month - 1 + step
+            nxt = date(p.year + m // 12, m % 12 + 1, 1)
+            if cadence == 'monthly': label = p.strftime('%Y-%m')
+            elif cadence == 'quarterly': label = f"{p.year}-Q{(p.month - 1) // 3 + 1}"
+            else: label = str(p.year)
+            periods.append((label, p, nxt))
+            p = nxt
+    else:
+        p = date(start.year, start.month, 1)
+        while p <= end:
+            nxt = (p + timedelta(days=32)).replace(day=1)
+            periods.append((p.strftime('%Y-%m'), p, nxt))
+            p = nxt
+    return periods
+
+def completion(days, start, cadence, target=None, rolling_periods=12):
+    # target None (daily): share of days hit per month; otherwise share of cadence periods with >= target hits.
+    # The open period only counts once it is already fulfilled.
+    end = start + timedelta(days=len(days) - 1)
+    series = {}
+    outcomes = []
+    for bucket, p_start, p_end in _period_bounds(cadence if target else 'daily', start, end):
+        lo = max((p_start - start).days, 0)
+        hi = min((p_end - start).days, len(days))
+        hits = days.count(HIT, lo, hi)
+        if target:
+            done = hits >= target
+            if p_end > end + timedelta(days=1) and not done: continue
+            total, ok = 1, int(done)
+        else:
+            total, ok = hi - lo, hits
+        b = series.setdefault(bucket, [0, 0])
+        b[0] += ok
+        b[1] += total
+        outcomes.append((ok, total))
+    ok_sum = sum(o for o, _ in outcomes)
+    total_sum = sum(t for _, t in outcomes)
+    recent = outcomes[-rolling_periods:]
+    recent_total = sum(t for _, t in recent)
+    return {
+        'rate': ok_sum / total_sum if total_sum else 0.0,
+        'rolling': sum(o for o, _ in recent) / recent_total if recent_total else 0.0,
+        'by_period': {k: round(v[0] / v[1], 3) for k, v in series.items() if v[1]},
+    }
+
+def miss_reasons(reasons, top=10):
+    counts = Counter((r or "").strip().lower() or "(no reason)" for r in reasons)
+    return counts.most_common(top)
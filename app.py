@@ -1,53 +1,73 @@
 import os
 import datetime
-import requests
 import hashlib
 import threading
 import json
-import telebot 
+import gzip
+import io
+import tempfile
+import bisect
+import queue
+from collections import OrderedDict
+import time
+import analytics
+import metrics
 from datetime import date, timedelta
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Blueprint, current_app, stream_with_context, request, jsonify, send_file, g, Response
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
-from flask_apscheduler import APScheduler
-
-app = Flask(__name__)
+from sqlalchemy import func, bindparam, select, event, inspect, text
+from sqlalchemy.orm.exc import StaleDataError
 
 # --- CONFIG ---
 TG_BOT_TOKEN = os.environ.get("TG_BOT_TOKEN", "YOUR_LOCAL_TOKEN")
 HASH_USER = os.environ.get("HASH_USER", "a080f87fefbcc9ddfe34650dd5c20659b852fd8cdd8e269a2bc5c3f4ad7cd7cf")
 HASH_ADMIN = os.environ.get("HASH_ADMIN", "a5a915b49d0188897ddbdcaf47868a28af8d06851f3430bbe43e49660f05760a")
 
-database_url = os.environ.get("DATABASE_URL")
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-if database_url:
-    if database_url.startswith("postgres://"):
-        database_url = database_url.replace("postgres://", "postgresql://", 1)
-    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-else:
+def database_uri():
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url:
+        if database_url.startswith("postgres://"):
+            database_url = database_url.replace("postgres://", "postgresql://", 1)
+        return database_url
     db_filename = 'Life_tracker.db'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, db_filename)
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return 'sqlite:///' + os.path.join(basedir, db_filename)
 
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    "pool_pre_ping": True, 
-    "pool_recycle": 280, 
-}
 class Config:
     SCHEDULER_API_ENABLED = True
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_pre_ping": True,
+        "pool_recycle": 280,
+    }
 
-app.config.from_object(Config())
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", 4))
+BOT_QUEUE_SIZE = int(os.environ.get("BOT_QUEUE_SIZE", 50))
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", 300))
+# (thread, year) grids kept per process, least recently used dropped first; one entry is ~125 KB
+GRID_CACHE_SIZE = int(os.environ.get("GRID_CACHE_SIZE", 200))
+# nightly backups are deltas against the previous one, with a full backup every BACKUP_FULL_EVERY_DAYS
+BACKUP_FULL_EVERY_DAYS = int(os.environ.get("BACKUP_FULL_EVERY_DAYS", 7))
 
-db = SQLAlchemy(app)
-scheduler = APScheduler()
+# web: HTTP only. background: bot polling + scheduler only (python app.py with APP_ROLE=background).
+# auto: serve HTTP and also run the background work if no other process on this host holds BACKGROUND_LOCK.
+# Importing the module (gunicorn 'app:app', --preload included) defaults to web, so deployments run one
+# APP_ROLE=background process next to the workers; a plain `python app.py` defaults to auto.
+APP_ROLE = os.environ.get("APP_ROLE") or ("auto" if __name__ == '__main__' else "web")
+BACKGROUND_LOCK = os.environ.get("BACKGROUND_LOCK", os.path.join(tempfile.gettempdir(), "life_tracker_background.lock"))
 
+db = SQLAlchemy()
+bp = Blueprint('main', __name__)
+
+# set by create_app() / init_bot() / start_background(); only the background process has a bot and scheduler
+app = None
 bot = None
-if TG_BOT_TOKEN and "YOUR_LOCAL" not in TG_BOT_TOKEN:
-    bot = telebot.TeleBot(TG_BOT_TOKEN)
+bot_dispatcher = None
+scheduler = None
 
-user_sessions = {}
+# per-request timings, SQL counts and bot handler timings, scraped from /api/metrics
+metrics.ENABLED = os.environ.get("METRICS") == "1"
 
 # --- MODELS ---
 class Thread(db.Model):
@@ -64,6 +84,8 @@ class Thread(db.Model):
     sub_category = db.Column(db.String(50))
     type = db.Column(db.String(20))     
     cadence = db.Column(db.String(50)) 
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    __table_args__ = (db.Index('ix_threads_status_rank', 'status', 'rank'),)
 
 class Chain(db.Model):
     __tablename__ = 'chains'
@@ -73,6 +95,7 @@ class Chain(db.Model):
     chain_end_date = db.Column(db.Date)
     duration = db.Column(db.Integer, default=0)
     end_reason = db.Column(db.String(255))
+    __table_args__ = (db.Index('ix_chains_thread_start', 'thread_id', 'chain_start_date'),)
 
 class Square(db.Model):
     __tablename__ = 'squares'
@@ -84,6 +107,13 @@ class Square(db.Model):
     chain_start = db.Column(db.Boolean, default=False)
     chain_end = db.Column(db.Boolean, default=False)
     chain_end_reason = db.Column(db.Text, default="") 
+    # chain bookkeeping keeps updated_at as is, see rebuild_chains / _move_chain
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    __table_args__ = (
+        db.Index('ix_squares_thread_status_period', 'thread_id', 'status', 'period'),
+        db.Index('ix_squares_chain_id', 'chain_id'),
+        db.Index('ix_squares_updated_at', 'updated_at'),
+    )
 
 class Calendar(db.Model):
     __tablename__ = 'calendar'
@@ -97,229 +127,1216 @@ class Calendar(db.Model):
     project_type_this_week = db.Column(db.String(100), default="") 
     day_meds = db.Column(db.Boolean, default=False) 
     comments = db.Column(db.Text, default="") 
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    # bumped by every ORM update; a concurrent writer gets StaleDataError instead of overwriting silently
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        db.Index('ix_calendar_off_routine', 'off_routine_flag', 'actual_date'),
+        db.Index('ix_calendar_updated_at', 'updated_at'),
+    )
 
 class BoardItem(db.Model):
     __tablename__ = 'board_items'
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class DayComment(db.Model):
+    __tablename__ = 'day_comments'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=True)
+    text = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.Index('ix_day_comments_day', 'day', 'id'),)
+
+class PeriodRollup(db.Model):
+    # closed week/month/quarter/year of a cadence thread, written by rollup_closed_periods; chain_id is the
+    # chain of the period's last hit. Derived data: not in backups, rebuilt nightly
+    __tablename__ = 'period_rollups'
+    thread_id = db.Column(db.Integer, db.ForeignKey('threads.thread_id'), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    period_end = db.Column(db.Date, nullable=False)
+    cadence = db.Column(db.String(50), nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    misses = db.Column(db.Integer, nullable=False, default=0)
+    fulfilled = db.Column(db.Boolean, nullable=False, default=False)
+    chain_id = db.Column(db.String(50), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class BotSession(db.Model):
+    __tablename__ = 'bot_sessions'
+    chat_id = db.Column(db.BigInteger, primary_key=True)
+    role = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now)
+
+class AppState(db.Model):
+    __tablename__ = 'app_state'
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Text)
+
+class DataVersion(db.Model):
+    # write counters: 'data' moves on every write, 'restore' only when a backup replaces everything
+    __tablename__ = 'data_versions'
+    scope = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.datetime.now)
+
+# --- MIGRATIONS ---
+# create_all() only creates missing tables; anything added to an existing table goes here, in order
+def _create_indexes(*models):
+    conn = db.session.connection()
+    for model in models:
+        columns = {c['name'] for c in inspect(conn).get_columns(model.__tablename__)}
+        for ix in model.__table__.indexes:
+            # indexes on columns a later migration adds are created by that migration
+            if all(c.name in columns for c in ix.columns): ix.create(conn, checkfirst=True)
+
+def _split_calendar_comments():
+    # plain SQL: the Calendar model may already have columns this database doesn't have yet
+    conn = db.session.connection()
+    blobs = conn.execute(text("SELECT actual_date, comments FROM calendar WHERE comments IS NOT NULL AND comments != ''")).all()
+    for actual_date, blob in blobs:
+        if isinstance(actual_date, str): actual_date = _parse_date(actual_date)
+        db.session.add_all(DayComment(**row) for row in split_comment_blob(actual_date, blob))
+    conn.execute(text("UPDATE calendar SET comments = '' WHERE comments IS NOT NULL AND comments != ''"))
+
+def _add_column(model, name, ddl):
+    # no-op on databases where create_all() already made the table with the column
+    conn = db.session.connection()
+    if name not in {c['name'] for c in inspect(conn).get_columns(model.__tablename__)}:
+        conn.exec_driver_sql(f"ALTER TABLE {model.__tablename__} ADD COLUMN {name} {ddl}")
+
+def _add_updated_at():
+    col_type = db.DateTime().compile(dialect=db.engine.dialect)
+    for model in (Thread, Square, Calendar, BoardItem): _add_column(model, 'updated_at', col_type)
+    _create_indexes(Square, Calendar)
+
+def _board_search_index():
+    # sqlite: external-content FTS5 table kept in sync by triggers; postgres: GIN expression index
+    conn = db.session.connection()
+    if db.engine.dialect.name == 'sqlite':
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS board_fts USING fts5(text, content='board_items', content_rowid='id')")
+        conn.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS board_fts_ai AFTER INSERT ON board_items BEGIN "
+                             "INSERT INTO board_fts(rowid, text) VALUES (new.id, new.text); END")
+        conn.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS board_fts_ad AFTER DELETE ON board_items BEGIN "
+                             "INSERT INTO board_fts(board_fts, rowid, text) VALUES ('delete', old.id, old.text); END")
+        conn.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS board_fts_au AFTER UPDATE OF text ON board_items BEGIN "
+                             "INSERT INTO board_fts(board_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+                             "INSERT INTO board_fts(rowid, text) VALUES (new.id, new.text); END")
+        conn.exec_driver_sql("INSERT INTO board_fts(board_fts) VALUES ('rebuild')")
+    elif db.engine.dialect.name == 'postgresql':
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_board_items_text_fts ON board_items USING gin (to_tsvector('simple', text))")
+
+MIGRATIONS = [
+    ('0001_hot_path_indexes', lambda: _create_indexes(Thread, Chain, Square, Calendar)),
+    ('0002_day_comments_from_calendar_blobs', _split_calendar_comments),
+    ('0003_updated_at_columns', _add_updated_at),
+    ('0004_board_search', _board_search_index),
+    ('0005_calendar_version', lambda: _add_column(Calendar, 'version', "INTEGER NOT NULL DEFAULT 1")),
+    ('0006_data_versions', lambda: [db.session.merge(DataVersion(scope=s, version=1)) for s in ('data', 'restore')]),
+]
+
+def run_migrations():
+    db.create_all()
+    applied = {m.version for m in SchemaMigration.query.all()}
+    for version, step in MIGRATIONS:
+        if version in applied: continue
+        try:
+            step()
+            db.session.add(SchemaMigration(version=version))
+            db.session.commit()
+            print(f"Migration applied: {version}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration {version} failed: {e}")
+            raise
 
 # --- LOGIC ---
 def get_date_40k(d_obj):
     iso = d_obj.isocalendar()
     return f"{str(iso[0])[2:]}.{iso[1]}.{iso[2]}"
 
+def split_comment_blob(d_date, blob):
+    # legacy Calendar.comments: one "[HH:MM] text" per line; lines without a time keep created_at empty
+    rows = []
+    for line in (blob or "").split('\n'):
+        if not line.strip(): continue
+        created_at = None
+        text_str = line
+        if line.startswith('[') and ']' in line:
+            end_bracket = line.find(']')
+            try:
+                created_at = datetime.datetime.combine(d_date, datetime.datetime.strptime(line[1:end_bracket], '%H:%M').time())
+                text_str = line[end_bracket+1:].strip()
+            except ValueError: pass
+        rows.append({'day': d_date, 'created_at': created_at, 'text': text_str})
+    return rows
+
+def add_day_comment(d_date, text):
+    db.session.add(DayComment(day=d_date, created_at=datetime.datetime.now(), text=text))
+
+def day_comments(d_date):
+    return DayComment.query.filter_by(day=d_date).order_by(DayComment.id).all()
+
+def format_comment(c):
+    return f"[{c.created_at.strftime('%H:%M')}] {c.text}" if c.created_at else c.text
+
+BOARD_PAGE_SIZE = 20
+
+def _fts_query(q):
+    # every word must match, as a prefix; quoted so user input can't use FTS5 syntax
+    return " ".join('"' + w.replace('"', '""') + '"*' for w in q.split())
+
+def board_page(before_id=None, limit=BOARD_PAGE_SIZE, q=None):
+    # newest first, keyset on id: pass the returned cursor back as before_id for the next page
+    query = BoardItem.query
+    if q and q.split():
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            ids = select(text("rowid")).select_from(text("board_fts")).where(text("board_fts MATCH :q"))
+            query = query.filter(BoardItem.id.in_(ids)).params(q=_fts_query(q))
+        elif dialect == 'postgresql':
+            query = query.filter(func.to_tsvector('simple', BoardItem.text).op('@@')(func.plainto_tsquery('simple', q)))
+        else:
+            query = query.filter(BoardItem.text.ilike(f"%{q}%"))
+    if before_id: query = query.filter(BoardItem.id < before_id)
+    items = query.order_by(BoardItem.id.desc()).limit(limit + 1).all()
+    return items[:limit], (items[limit - 1].id if len(items) > limit else None)
+
+def dialect_insert(table):
+    # INSERT that supports ON CONFLICT, or None on databases without it
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite': from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql': from sqlalchemy.dialects.postgresql import insert
+    else: return None
+    return insert(table)
+
 def ensure_calendar_entry(d_date):
+    # safe against a concurrent insert of the same day; runs in the caller's transaction, the caller commits
     entry = db.session.get(Calendar, d_date)
-    if not entry:
-        iso = d_date.isocalendar()
-        entry = Calendar(
-            actual_date=d_date,
-            date_40k=get_date_40k(d_date),
-            week_40k=f"{str(iso[0])[2:]}.{iso[1]}"
-        )
-        db.session.add(entry)
-        db.session.commit()
-    return entry
+    if entry: return entry
+    iso = d_date.isocalendar()
+    row = {'actual_date': d_date, 'date_40k': get_date_40k(d_date), 'week_40k': f"{str(iso[0])[2:]}.{iso[1]}"}
+    stmt = dialect_insert(Calendar.__table__)
+    if stmt is None:
+        db.session.add(Calendar(**row))
+        db.session.flush()
+        return db.session.get(Calendar, d_date)
+    db.session.execute(stmt.values(**row).on_conflict_do_nothing(index_elements=['actual_date']))
+    return db.session.get(Calendar, d_date)
 
-def recalculate_chains(thread_id):
-    try:
-        Chain.query.filter_by(thread_id=thread_id).delete()
-        thread = db.session.get(Thread, thread_id)
-        if not thread: return
-        
-        tolerance_days = 1 
-        if thread.cadence == 'weekly': tolerance_days = 7
-        elif thread.cadence == '3x_week': tolerance_days = 3
-        elif thread.cadence == 'monthly': tolerance_days = 31
-        elif thread.cadence == 'quarterly': tolerance_days = 92
-        elif thread.cadence == 'yearly': tolerance_days = 366
-
-        hits = Square.query.filter_by(thread_id=thread_id, status='hit').order_by(Square.period).all()
-        if not hits:
-            db.session.commit()
+class SquareStore:
+    # per (thread_id, year) bytearray of status codes indexed by day of year; miss reasons kept sparse
+    EMPTY, HIT, MISS = 0, 1, 2
+    NAMES = ('empty', 'hit', 'miss')
+
+    def __init__(self):
+        self.years = {}
+        self.reasons = {}
+
+    @classmethod
+    def load(cls, thread_ids=None, start=None, end=None):
+        sq = Square.__table__.c
+        q = select(sq.thread_id, sq.period, sq.status, sq.chain_end_reason).where(sq.status.in_(('hit', 'miss')))
+        if thread_ids is not None: q = q.where(sq.thread_id.in_(list(thread_ids)))
+        if start: q = q.where(sq.period >= start)
+        if end: q = q.where(sq.period <= end)
+        store = cls()
+        years, reasons, jan1 = store.years, store.reasons, {}
+        for t_id, period, status, reason in db.session.execute(q):
+            arr = years.get((t_id, period.year))
+            if arr is None: arr = years[(t_id, period.year)] = bytearray(366)
+            base = jan1.get(period.year)
+            if base is None: base = jan1[period.year] = date(period.year, 1, 1).toordinal()
+            if status == 'hit': arr[period.toordinal() - base] = cls.HIT
+            else:
+                arr[period.toordinal() - base] = cls.MISS
+                if reason: reasons[(t_id, period)] = reason
+        return store
+
+    def code(self, thread_id, d):
+        arr = self.years.get((thread_id, d.year))
+        return arr[d.timetuple().tm_yday - 1] if arr else self.EMPTY
+
+    def status(self, thread_id, d):
+        return self.NAMES[self.code(thread_id, d)]
+
+    def reason(self, thread_id, d):
+        return self.reasons.get((thread_id, d), "")
+
+    def count_hits(self, thread_id, start, end):
+        total = 0
+        for year in range(start.year, end.year + 1):
+            arr = self.years.get((thread_id, year))
+            if not arr: continue
+            lo = start.timetuple().tm_yday - 1 if year == start.year else 0
+            hi = end.timetuple().tm_yday if year == end.year else 366
+            total += arr.count(self.HIT, lo, hi)
+        return total
+
+    def dates(self, thread_id, code):
+        for year in sorted(y for t_id, y in self.years if t_id == thread_id):
+            arr = self.years[(thread_id, year)]
+            jan1 = date(year, 1, 1)
+            i = arr.find(code)
+            while i != -1:
+                yield jan1 + timedelta(days=i)
+                i = arr.find(code, i + 1)
+
+    def hit_dates(self, thread_id):
+        return list(self.dates(thread_id, self.HIT))
+
+    def first_date(self, thread_id):
+        years = sorted(y for t_id, y in self.years if t_id == thread_id)
+        for year in years:
+            arr = self.years[(thread_id, year)]
+            offset = len(arr) - len(arr.lstrip(b'\x00'))
+            if offset < len(arr): return date(year, 1, 1) + timedelta(days=offset)
+        return None
+
+    def day_array(self, thread_id, start, end):
+        # contiguous codes for start..end (no slot for Feb 29 in common years)
+        parts = []
+        for year in range(start.year, end.year + 1):
+            arr = self.years.get((thread_id, year)) or bytes(366)
+            lo = start.timetuple().tm_yday - 1 if year == start.year else 0
+            hi = end.timetuple().tm_yday if year == end.year else date(year, 12, 31).timetuple().tm_yday
+            parts.append(bytes(arr[lo:hi]))
+        return b"".join(parts)
+
+    def misses(self, thread_id):
+        return [(d, self.reason(thread_id, d)) for d in self.dates(thread_id, self.MISS)]
+
+CADENCE_TOLERANCE = {'weekly': 7, '3x_week': 3, 'monthly': 31, 'quarterly': 92, 'yearly': 366}
+CHAIN_VERIFY = os.environ.get("CHAIN_VERIFY") == "1"
+
+def chain_tolerance(thread):
+    return CADENCE_TOLERANCE.get(thread.cadence, 1)
+
+def chain_id_for(thread_id, d_date):
+    return f"CH_{thread_id}_{d_date.strftime('%Y%m%d')}"
+
+def compute_chains(thread_id, tolerance, hit_dates, misses):
+    # hit_dates and misses [(period, reason)] sorted by period
+    miss_dates = [m[0] for m in misses]
+    chains = []
+    for d in hit_dates:
+        if chains and (d - chains[-1]['chain_end_date']).days <= tolerance:
+            chains[-1]['chain_end_date'] = d
+            chains[-1]['duration'] += 1
+            continue
+        if chains:
+            i = bisect.bisect_right(miss_dates, chains[-1]['chain_end_date'])
+            chains[-1]['end_reason'] = misses[i][1] if i < len(misses) and miss_dates[i] < d else "gap"
+        chains.append({'chain_id': chain_id_for(thread_id, d), 'thread_id': thread_id, 'chain_start_date': d,
+                       'chain_end_date': d, 'duration': 1, 'end_reason': ""})
+    return chains
+
+def _thread_hits_and_misses(thread_id):
+    store = SquareStore.load([thread_id])
+    return store.hit_dates(thread_id), store.misses(thread_id)
+
+def rebuild_chains(thread_id):
+    thread = db.session.get(Thread, thread_id)
+    if not thread: return
+    hit_dates, misses = _thread_hits_and_misses(thread_id)
+    chains = compute_chains(thread_id, chain_tolerance(thread), hit_dates, misses)
+    hit_ids = db.session.query(Square.square_id, Square.period).filter(
+        Square.thread_id == thread_id, Square.status == 'hit').order_by(Square.period).all()
+
+    Square.query.filter(Square.thread_id == thread_id, Square.chain_id != None).update(
+        {Square.chain_id: None, Square.updated_at: Square.updated_at}, synchronize_session=False)
+    Chain.query.filter_by(thread_id=thread_id).delete()
+    if chains:
+        db.session.execute(Chain.__table__.insert(), chains)
+        links = []
+        i = 0
+        for sq_id, period in hit_ids:
+            while period > chains[i]['chain_end_date']: i += 1
+            links.append({'sid': sq_id, 'cid': chains[i]['chain_id']})
+        sq = Square.__table__.c
+        db.session.execute(Square.__table__.update().where(sq.square_id == bindparam('sid')).values(
+            chain_id=bindparam('cid'), updated_at=sq.updated_at), links)
+    db.session.flush()
+
+def chains_match(thread_id):
+    # verification path: stored chains vs a fresh in-memory computation
+    thread = db.session.get(Thread, thread_id)
+    if not thread: return True
+    hit_dates, misses = _thread_hits_and_misses(thread_id)
+    expected = compute_chains(thread_id, chain_tolerance(thread), hit_dates, misses)
+    stored = Chain.query.filter_by(thread_id=thread_id).order_by(Chain.chain_start_date).all()
+    got = [{'chain_id': c.chain_id, 'thread_id': c.thread_id, 'chain_start_date': c.chain_start_date,
+            'chain_end_date': c.chain_end_date, 'duration': c.duration, 'end_reason': c.end_reason} for c in stored]
+    return got == expected
+
+def _gap_reason(thread_id, after, before):
+    if before is None: return ""
+    miss_sq = Square.query.filter(Square.thread_id == thread_id, Square.status == 'miss',
+                                  Square.period > after, Square.period < before).order_by(Square.period).first()
+    return (miss_sq.chain_end_reason or "") if miss_sq else "gap"
+
+def _hit_bound(thread_id, agg, lo, hi):
+    return db.session.query(agg(Square.period)).filter(Square.thread_id == thread_id, Square.status == 'hit',
+                                                       Square.period > lo, Square.period < hi).scalar()
+
+def _count_hits(thread_id, lo, hi):
+    return db.session.query(func.count(Square.square_id)).filter(Square.thread_id == thread_id, Square.status == 'hit',
+                                                                 Square.period >= lo, Square.period <= hi).scalar()
+
+def _move_chain(old_chain, new_chain, from_date=None):
+    # new_chain must be flushed before squares point at it
+    db.session.flush()
+    q = Square.query.filter(Square.chain_id == old_chain.chain_id)
+    if from_date: q = q.filter(Square.period >= from_date)
+    q.update({Square.chain_id: new_chain.chain_id, Square.updated_at: Square.updated_at}, synchronize_session='fetch')
+
+def update_chains(thread_id, d_date, was_hit):
+    # splits, extends or merges only the chains around d_date; O(1) queries per click
+    thread = db.session.get(Thread, thread_id)
+    if not thread: return
+    tol = chain_tolerance(thread)
+    sq = db.session.get(Square, f"{thread_id}_{d_date.strftime('%Y-%m-%d')}")
+    is_hit = bool(sq and sq.status == 'hit')
+    prev = Chain.query.filter(Chain.thread_id == thread_id, Chain.chain_start_date <= d_date).order_by(Chain.chain_start_date.desc()).first()
+    nxt = Chain.query.filter(Chain.thread_id == thread_id, Chain.chain_start_date > d_date).order_by(Chain.chain_start_date).first()
+    inside = bool(prev and prev.chain_end_date >= d_date)
+    if was_hit and not inside: raise ValueError("chains out of sync")
+
+    if is_hit:
+        if inside:
+            if not was_hit: prev.duration += 1
+            sq.chain_id = prev.chain_id
+        elif prev and (d_date - prev.chain_end_date).days <= tol:
+            prev.chain_end_date = d_date
+            prev.duration += 1
+            sq.chain_id = prev.chain_id
+            if nxt and (nxt.chain_start_date - d_date).days <= tol:
+                _move_chain(nxt, prev)
+                prev.chain_end_date = nxt.chain_end_date
+                prev.duration += nxt.duration
+                prev.end_reason = nxt.end_reason
+                db.session.delete(nxt)
+            else:
+                prev.end_reason = _gap_reason(thread_id, d_date, nxt.chain_start_date if nxt else None)
+        else:
+            new_chain = Chain(chain_id=chain_id_for(thread_id, d_date), thread_id=thread_id, chain_start_date=d_date,
+                              chain_end_date=d_date, duration=1, end_reason="")
+            db.session.add(new_chain)
+            if nxt and (nxt.chain_start_date - d_date).days <= tol:
+                _move_chain(nxt, new_chain)
+                new_chain.chain_end_date = nxt.chain_end_date
+                new_chain.duration += nxt.duration
+                new_chain.end_reason = nxt.end_reason
+                db.session.delete(nxt)
+            else:
+                new_chain.end_reason = _gap_reason(thread_id, d_date, nxt.chain_start_date if nxt else None)
+            db.session.flush()
+            sq.chain_id = new_chain.chain_id
+            if prev: prev.end_reason = _gap_reason(thread_id, prev.chain_end_date, d_date)
+    elif inside and was_hit:
+        if sq: sq.chain_id = None
+        left = _hit_bound(thread_id, func.max, prev.chain_start_date - timedelta(days=1), d_date)
+        right = _hit_bound(thread_id, func.min, d_date, prev.chain_end_date + timedelta(days=1))
+        if left and right and (right - left).days <= tol:
+            prev.duration -= 1
+        else:
+            if right:
+                right_chain = Chain(chain_id=chain_id_for(thread_id, right), thread_id=thread_id, chain_start_date=right,
+                                    chain_end_date=prev.chain_end_date, duration=_count_hits(thread_id, right, prev.chain_end_date),
+                                    end_reason=prev.end_reason)
+                db.session.add(right_chain)
+                _move_chain(prev, right_chain, from_date=right)
+            following = right or (nxt.chain_start_date if nxt else None)
+            if left:
+                prev.duration -= 1 + (right_chain.duration if right else 0)
+                prev.chain_end_date = left
+                prev.end_reason = _gap_reason(thread_id, left, following)
+            else:
+                before = Chain.query.filter(Chain.thread_id == thread_id, Chain.chain_start_date < prev.chain_start_date).order_by(Chain.chain_start_date.desc()).first()
+                db.session.delete(prev)
+                if before: before.end_reason = _gap_reason(thread_id, before.chain_end_date, following)
+    elif prev and not inside and nxt:
+        # a miss (or its reason) inside the gap after prev decides prev's end_reason
+        prev.end_reason = _gap_reason(thread_id, prev.chain_end_date, nxt.chain_start_date)
+    db.session.flush()
+
+def recalculate_chains(thread_id, changed_date=None, was_hit=False):
+    # runs in the caller's transaction (after lock_threads), the caller commits; a failed incremental
+    # update is rolled back to its savepoint and replaced by a full rebuild
+    thread_id = int(thread_id)
+    if changed_date is not None:
+        try:
+            with db.session.begin_nested():
+                update_chains(thread_id, changed_date, was_hit)
+                if CHAIN_VERIFY and not chains_match(thread_id): raise ValueError("incremental chains diverged")
             return
-        
-        current_chain = None
-        for i, sq in enumerate(hits):
-            if current_chain is None:
-                new_chain_id = f"CH_{thread_id}_{sq.period.strftime('%Y%m%d')}"
-                current_chain = Chain(chain_id=new_chain_id, thread_id=thread_id, chain_start_date=sq.period, chain_end_date=sq.period, duration=1, end_reason="")
-                db.session.add(current_chain)
-                sq.chain_id = new_chain_id 
+        except Exception as e:
+            print(f"Chain incremental fallback: {e}")
+    rebuild_chains(thread_id)
+
+def lock_threads(thread_ids):
+    # serialises square writes + chain maintenance per thread across workers and the bot: row locks on
+    # postgres; sqlite has no row locks, but a first write takes the database write lock until commit
+    t = Thread.__table__.c
+    ids = sorted(set(int(i) for i in thread_ids))
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(Thread.__table__.update().where(t.thread_id.in_(ids)).values(rank=t.rank, updated_at=t.updated_at))
+    else:
+        db.session.execute(select(t.thread_id).where(t.thread_id.in_(ids)).order_by(t.thread_id).with_for_update())
+
+SQUARE_STATUSES = ('hit', 'miss', 'empty')
+MAX_BATCH = 1000
+
+def upsert_squares(rows):
+    # rows: dicts with square_id, thread_id, period, status, chain_end_reason; one INSERT .. ON CONFLICT per batch
+    stmt = dialect_insert(Square.__table__)
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_update(index_elements=['square_id'], set_={
+            'status': stmt.excluded.status, 'chain_end_reason': stmt.excluded.chain_end_reason,
+            'updated_at': stmt.excluded.updated_at})
+        db.session.execute(stmt, rows)
+    else:
+        for row in rows: db.session.merge(Square(**row))
+
+def apply_square_updates(items):
+    # items: [(thread_id, date, status, miss_reason)]; squares and chains in one transaction, chains once per touched thread
+    rows = {}
+    for t_id, d_date, status, reason in items:
+        if status not in SQUARE_STATUSES: raise ValueError(f"bad status: {status}")
+        t_id = int(t_id)
+        sq_id = f"{t_id}_{d_date.strftime('%Y-%m-%d')}"
+        rows[sq_id] = {'square_id': sq_id, 'thread_id': t_id, 'period': d_date, 'status': status,
+                       'chain_end_reason': (reason or "") if status == 'miss' else ""}
+    if not rows: return 0
+    if len(rows) > MAX_BATCH: raise ValueError(f"too many squares (max {MAX_BATCH})")
+    by_thread = {}
+    for row in rows.values(): by_thread.setdefault(row['thread_id'], []).append(row)
+    try:
+        lock_threads(by_thread)
+        version = bump_data_version()
+        for t_id, changed in by_thread.items():
+            # a week/quarter straddling new year shows its fulfilment in both years' grids
+            thread = db.session.get(Thread, t_id)
+            periods = [cadence_period(thread.cadence, row['period']) for row in changed] if thread and thread.cadence in CADENCE_TARGETS else []
+            years = {row['period'].year for row in changed} | {d.year for p in periods for d in p}
+            for year in years: invalidate_grid_cache(t_id, year, version)
+        previous = dict(db.session.query(Square.square_id, Square.status).filter(Square.square_id.in_(list(rows))).all())
+        upsert_squares(list(rows.values()))
+        for t_id, changed in by_thread.items():
+            if len(changed) == 1:
+                recalculate_chains(t_id, changed_date=changed[0]['period'], was_hit=previous.get(changed[0]['square_id']) == 'hit')
             else:
-                gap = (sq.period - current_chain.chain_end_date).days
-                if gap <= tolerance_days:
-                    current_chain.chain_end_date = sq.period
-                    current_chain.duration += 1
-                    sq.chain_id = current_chain.chain_id
-                else:
-                    last_end = current_chain.chain_end_date
-                    miss_sq = Square.query.filter(Square.thread_id==thread_id, Square.status=='miss', Square.period > last_end, Square.period < sq.period).first()
-                    current_chain.end_reason = miss_sq.chain_end_reason if miss_sq else "gap"
-                    new_chain_id = f"CH_{thread_id}_{sq.period.strftime('%Y%m%d')}"
-                    current_chain = Chain(chain_id=new_chain_id, thread_id=thread_id, chain_start_date=sq.period, chain_end_date=sq.period, duration=1, end_reason="")
-                    db.session.add(current_chain)
-                    sq.chain_id = new_chain_id
+                recalculate_chains(t_id)
+            thread = db.session.get(Thread, t_id)
+            if thread: refresh_rollups(thread, [row['period'] for row in changed])
         db.session.commit()
-    except Exception as e:
-        print(f"Chain error: {e}")
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+def parse_bulk_dates(spec, today):
+    # "2026-10-01..2026-10-07", "today", "-3" (three days ago), comma separated
+    dates = []
+    for part in spec.split(','):
+        part = part.strip()
+        if '..' in part:
+            lo, hi = (parse_bulk_dates(p, today)[0] for p in part.split('..', 1))
+            if hi < lo: lo, hi = hi, lo
+            if (hi - lo).days >= MAX_BATCH: raise ValueError("range too long")
+            dates += [lo + timedelta(days=i) for i in range((hi - lo).days + 1)]
+        elif part == 'today': dates.append(today)
+        elif part.lstrip('-').isdigit(): dates.append(today - timedelta(days=abs(int(part))))
+        else: dates.append(datetime.datetime.strptime(part, '%Y-%m-%d').date())
+    return dates
+
+CADENCE_TARGETS = {'3x_week': 3, 'weekly': 1, 'monthly': 1, 'quarterly': 1, 'yearly': 1}
+
+def cadence_bucket(cadence, d):
+    if cadence in ('weekly', '3x_week'):
+        iso = d.isocalendar()
+        return (iso[0], iso[1])
+    if cadence == 'monthly': return (d.year, d.month)
+    if cadence == 'quarterly': return (d.year, (d.month - 1) // 3)
+    if cadence == 'yearly': return (d.year,)
+    return None
+
+def cadence_period(cadence, d):
+    # first and last day of the week/month/quarter/year containing d
+    if cadence in ('weekly', '3x_week'):
+        start = d - timedelta(days=d.weekday())
+        return start, start + timedelta(days=6)
+    if cadence == 'monthly': start, months = d.replace(day=1), 1
+    elif cadence == 'quarterly': start, months = date(d.year, (d.month - 1) // 3 * 3 + 1, 1), 3
+    else: start, months = date(d.year, 1, 1), 12
+    m = start.month - 1 + months
+    return start, date(start.year + m // 12, m % 12 + 1, 1) - timedelta(days=1)
+
+def cadence_window(threads, start, end):
+    # start..end widened to whole cadence periods, so a week straddling new year is counted from both years
+    periods = [(cadence_period(th.cadence, start)[0], cadence_period(th.cadence, end)[1]) for th in threads if th.cadence in CADENCE_TARGETS]
+    return min([start] + [p[0] for p in periods]), max([end] + [p[1] for p in periods])
 
-def is_day_fulfilled(thread, date_obj, squares_map):
+def build_cadence_index(threads, store, start=None, end=None):
+    # hits per (thread, week/month/quarter/year) bucket, built once per request. With a start..end window,
+    # closed periods come from period_rollups and only the periods outside the rolled up range are counted;
+    # the store must then cover the whole periods at the window edges (see cadence_window)
+    index, covered = load_rollups(threads, start, end) if start else ({}, {})
+    for th in threads:
+        if th.cadence not in CADENCE_TARGETS: continue
+        if th.thread_id not in covered:
+            for d in store.dates(th.thread_id, SquareStore.HIT):
+                key = (th.thread_id, cadence_bucket(th.cadence, d))
+                index[key] = index.get(key, 0) + 1
+            continue
+        first, last = covered[th.thread_id]
+        for lo, hi in ((start, min(end, first - timedelta(days=1))), (max(start, last + timedelta(days=1)), end)):
+            p = lo
+            while p <= hi:
+                p_start, p_end = cadence_period(th.cadence, p)
+                hits = store.count_hits(th.thread_id, p_start, p_end)
+                if hits: index[(th.thread_id, cadence_bucket(th.cadence, p))] = hits
+                p = p_end + timedelta(days=1)
+    return index
+
+def is_day_fulfilled(thread, date_obj, store, cadence_index=None):
     try:
         if not thread.cadence or thread.cadence == 'daily': return False
-        target_hits = 1
-        start_date = None
-        end_date = None
-        if thread.cadence == '3x_week':
-            start_date = date_obj - timedelta(days=date_obj.weekday())
-            end_date = start_date + timedelta(days=6)
-            target_hits = 3
-        elif thread.cadence == 'weekly':
-            start_date = date_obj - timedelta(days=date_obj.weekday())
-            end_date = start_date + timedelta(days=6)
-        elif thread.cadence == 'monthly':
-            start_date = date_obj.replace(day=1)
-            next_month = (start_date + timedelta(days=32)).replace(day=1)
-            end_date = next_month - timedelta(days=1)
-        elif thread.cadence == 'quarterly':
-            quarter = (date_obj.month - 1) // 3 + 1
-            start_month = (quarter - 1) * 3 + 1
-            start_date = date(date_obj.year, start_month, 1)
-            if start_month + 3 > 12: end_date = date(date_obj.year, 12, 31)
-            else: end_date = date(date_obj.year, start_month + 3, 1) - timedelta(days=1)
-        elif thread.cadence == 'yearly':
-            start_date = date(date_obj.year, 1, 1)
-            end_date = date(date_obj.year, 12, 31)
-        else: return False
-
-        hits_count = 0
-        delta = (end_date - start_date).days
-        for i in range(delta + 1):
-            check_date = start_date + timedelta(days=i)
-            sq = squares_map.get((thread.thread_id, check_date))
-            if sq and sq.status == 'hit': hits_count += 1
+        if thread.cadence not in CADENCE_TARGETS: return False
+        target_hits = CADENCE_TARGETS[thread.cadence]
+
+        if cadence_index is not None:
+            hits_count = cadence_index.get((thread.thread_id, cadence_bucket(thread.cadence, date_obj)), 0)
+        else:
+            start_date, end_date = cadence_period(thread.cadence, date_obj)
+            hits_count = store.count_hits(thread.thread_id, start_date, end_date)
         
-        current_sq = squares_map.get((thread.thread_id, date_obj))
-        is_currently_hit = (current_sq and current_sq.status == 'hit')
+        is_currently_hit = store.code(thread.thread_id, date_obj) == SquareStore.HIT
         if hits_count >= target_hits and not is_currently_hit: return True
         return False
     except: return False
 
+# --- PERIOD ROLLUPS ---
+def compute_rollups(thread, first, last, today):
+    # rollup rows for the closed cadence periods from the one containing `first` to the one containing `last`
+    start = cadence_period(thread.cadence, first)[0]
+    end = min(cadence_period(thread.cadence, last)[1], cadence_period(thread.cadence, today)[0] - timedelta(days=1))
+    if end < start: return []
+    sq = Square.__table__.c
+    squares = db.session.execute(select(sq.period, sq.status, sq.chain_id).where(
+        sq.thread_id == thread.thread_id, sq.status.in_(('hit', 'miss')), sq.period >= start, sq.period <= end
+    ).order_by(sq.period)).all()
+    target = CADENCE_TARGETS[thread.cadence]
+    now = datetime.datetime.now()
+    rows = []
+    i = 0
+    p = start
+    while p <= end:
+        p_end = cadence_period(thread.cadence, p)[1]
+        row = {'thread_id': thread.thread_id, 'period_start': p, 'period_end': p_end, 'cadence': thread.cadence,
+               'hits': 0, 'misses': 0, 'chain_id': None, 'updated_at': now}
+        while i < len(squares) and squares[i].period <= p_end:
+            if squares[i].status == 'hit':
+                row['hits'] += 1
+                row['chain_id'] = squares[i].chain_id
+            else: row['misses'] += 1
+            i += 1
+        row['fulfilled'] = row['hits'] >= target
+        rows.append(row)
+        p = p_end + timedelta(days=1)
+    return rows
+
+def refresh_rollups(thread, dates, today=None):
+    # inside a square write's transaction, after its chains: recompute the stored rollups of the periods holding
+    # `dates` and of the periods whose chains those dates could have merged, split or renamed. Periods without
+    # a row yet are left to the nightly job, so the rolled up range of a thread stays contiguous
+    if thread.cadence not in CADENCE_TARGETS or not dates: return
+    lo, hi = min(dates), max(dates)
+    tolerance = timedelta(days=chain_tolerance(thread))
+    c = Chain.__table__.c
+    for s, e in db.session.execute(select(c.chain_start_date, c.chain_end_date).where(
+            c.thread_id == thread.thread_id, c.chain_start_date <= hi + tolerance, c.chain_end_date >= lo - tolerance)):
+        lo, hi = min(lo, s), max(hi, e)
+    r = PeriodRollup.__table__.c
+    stored = set(db.session.execute(select(r.period_start).where(
+        r.thread_id == thread.thread_id, r.cadence == thread.cadence, r.period_end >= lo, r.period_start <= hi)).scalars())
+    if not stored: return
+    rows = [row for row in compute_rollups(thread, min(stored), max(stored), today or date.today()) if row['period_start'] in stored]
+    db.session.execute(PeriodRollup.__table__.update().where(
+        r.thread_id == bindparam('t_id'), r.period_start == bindparam('p_start')
+    ).values(hits=bindparam('hits'), misses=bindparam('misses'), fulfilled=bindparam('fulfilled'),
+             chain_id=bindparam('chain_id'), updated_at=bindparam('updated_at')),
+        [{'t_id': row['thread_id'], 'p_start': row['period_start'], 'hits': row['hits'], 'misses': row['misses'],
+          'fulfilled': row['fulfilled'], 'chain_id': row['chain_id'], 'updated_at': row['updated_at']} for row in rows])
+
+def load_rollups(threads, start, end):
+    # ({(thread_id, bucket): hits} for the rolled up periods overlapping start..end, {thread_id: (first, last) day rolled up})
+    cadences = {th.thread_id: th.cadence for th in threads if th.cadence in CADENCE_TARGETS}
+    if not cadences: return {}, {}
+    r = PeriodRollup.__table__.c
+    covered = {}
+    for t_id, cadence, first, last in db.session.execute(select(
+            r.thread_id, r.cadence, func.min(r.period_start), func.max(r.period_end)
+    ).where(r.thread_id.in_(list(cadences))).group_by(r.thread_id, r.cadence)):
+        if cadence == cadences[t_id]: covered[t_id] = (first, last)
+    index = {}
+    if covered:
+        for t_id, cadence, p_start, hits in db.session.execute(select(r.thread_id, r.cadence, r.period_start, r.hits).where(
+                r.thread_id.in_(list(covered)), r.period_end >= start, r.period_start <= end)):
+            if cadence == cadences[t_id] and hits: index[(t_id, cadence_bucket(cadence, p_start))] = hits
+    return index, covered
+
+def rollup_closed_periods():
+    # nightly job: rebuild every cadence thread's rollups up to the last closed period, one thread per transaction
+    try:
+        with app.app_context():
+            today = date.today()
+            ids = [t_id for (t_id,) in db.session.query(Thread.thread_id).filter(
+                Thread.status == 'active', Thread.cadence.in_(list(CADENCE_TARGETS)))]
+            for t_id in ids:
+                try:
+                    lock_threads([t_id])
+                    thread = db.session.get(Thread, t_id)
+                    first = db.session.query(func.min(Square.period)).filter(Square.thread_id == t_id, Square.status != 'empty').scalar()
+                    rows = compute_rollups(thread, min(d for d in (thread.created_at, first, today) if d), today, today)
+                    PeriodRollup.query.filter_by(thread_id=t_id).delete()
+                    if rows: db.session.execute(PeriodRollup.__table__.insert(), rows)
+                    invalidate_grid_cache(t_id, version=bump_data_version())
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+    except Exception as e:
+        print(f"Rollup failed: {e}")
+
+def compute_stats(thread_ids=None):
+    today = date.today()
+    q = Thread.query.filter(Thread.status == 'active')
+    if thread_ids: q = Thread.query.filter(Thread.thread_id.in_(thread_ids))
+    threads = q.order_by(Thread.rank.desc()).all()
+    store = SquareStore.load([th.thread_id for th in threads], end=today)
+    reasons_by_thread = {}
+    for (t_id, _), r in store.reasons.items(): reasons_by_thread.setdefault(t_id, []).append(r)
+    result = []
+    all_reasons = []
+    for th in threads:
+        first = store.first_date(th.thread_id)
+        start = min(d for d in (th.created_at, first, today) if d)
+        days = store.day_array(th.thread_id, start, today)
+        reasons = reasons_by_thread.get(th.thread_id, [])
+        misses = days.count(SquareStore.MISS)
+        reasons += [""] * (misses - len(reasons))
+        all_reasons += reasons
+        result.append({
+            'id': th.thread_id, 'name': th.thread_name, 'cadence': th.cadence or 'daily', 'since': start.strftime('%Y-%m-%d'),
+            'streaks': analytics.streaks(days, chain_tolerance(th)),
+            'completion': analytics.completion(days, start, th.cadence, CADENCE_TARGETS.get(th.cadence)),
+            'miss_reasons': analytics.miss_reasons(reasons),
+        })
+    return {'threads': result, 'miss_reasons': analytics.miss_reasons(all_reasons)}
+
+CATEGORIES = ['work', 'self care', 'home and family', 'frogs']
+STATUS_CODES = {'empty': '.', 'hit': 'h', 'miss': 'm'}
+
+# --- GRID CACHE ---
+# per-process cache of week grids keyed by (thread_id, year). Entries are stamped with the data version
+# the request saw before reading; a write marks what it changes with its own version before it commits,
+# so an entry built from older rows is never served under a newer version (and ETag)
+grid_cache = OrderedDict()
+grid_cache_lock = threading.Lock()
+grid_cache_stats = {'hits': 0, 'misses': 0}
+grid_cache_state = {'version': None}  # data version the cache has accounted for
+grid_cache_marks = {}  # (thread_id | None, year | None) -> version of the last write touching those grids
+grid_cache_own = set()  # versions written by this process that sync_grid_cache hasn't seen yet
+
+def data_version(scope='data'):
+    return db.session.execute(select(DataVersion.version).where(DataVersion.scope == scope)).scalar() or 0
+
+def bump_data_version(*scopes):
+    # inside the write's transaction, before its commit; returns the version the commit will publish
+    # pending ORM changes go out first, so every write path locks its own rows before data_versions
+    db.session.flush()
+    t = DataVersion.__table__.c
+    db.session.execute(DataVersion.__table__.update().where(t.scope.in_(('data',) + scopes)).values(version=t.version + 1))
+    new = data_version()
+    db.session.info.setdefault('data_versions', []).append(new)
+    return new
+
+@event.listens_for(db.session, 'after_commit')
+def _own_versions_committed(session):
+    # only a committed version is ours; a rolled back one may be committed by another process later
+    versions = session.info.pop('data_versions', None)
+    if versions:
+        with grid_cache_lock: grid_cache_own.update(versions)
+
+@event.listens_for(db.session, 'after_rollback')
+def _own_versions_rolled_back(session):
+    session.info.pop('data_versions', None)
+
+def sync_grid_cache():
+    # a version we didn't write means another worker or the bot process changed something: drop everything
+    version = data_version()
+    with grid_cache_lock:
+        seen = grid_cache_state['version']
+        if seen is not None and version > seen and not all(v in grid_cache_own for v in range(seen + 1, version + 1)):
+            grid_cache.clear()
+        elif seen is not None and version < seen:
+            grid_cache.clear()  # the database was replaced underneath us
+        grid_cache_state['version'] = version
+        grid_cache_own.difference_update([v for v in grid_cache_own if v <= version])
+    g.data_version = version
+    return version
+
+def invalidate_grid_cache(thread_id=None, year=None, version=None):
+    # called before the write commits with the version from bump_data_version
+    with grid_cache_lock:
+        if version is not None:
+            key = (None if thread_id is None else int(thread_id), year)
+            grid_cache_marks[key] = max(grid_cache_marks.get(key, 0), version)
+        for key in list(grid_cache):
+            if (thread_id is None or key[0] == int(thread_id)) and (year is None or key[1] == year):
+                del grid_cache[key]
+
+def _grid_mark(thread_id, year):
+    return max(grid_cache_marks.get(k, 0) for k in ((thread_id, year), (thread_id, None), (None, year), (None, None)))
+
+def build_thread_weeks(th, start_year, end_year, store, off_routine_days, cadence_index, today):
+    days = []
+    start_weekday = start_year.weekday() 
+    for _ in range(start_weekday): days.append({'is_padding': True})
+    delta = end_year - start_year
+    for i in range(delta.days + 1):
+        curr = start_year + timedelta(days=i)
+        days.append({
+            'date': curr.strftime('%Y-%m-%d'), 
+            'is_today': (curr == today), 
+            'status': store.status(th.thread_id, curr), 
+            'is_off_routine': off_routine_days.get(curr, False), 
+            'is_fulfilled': is_day_fulfilled(th, curr, store, cadence_index), 
+            'is_padding': False,
+            'miss_reason': store.reason(th.thread_id, curr)
+        })
+    return [days[i:i + 7] for i in range(0, len(days), 7)]
+
+def get_year_grids(threads, year, today):
+    result = {}
+    missing = []
+    version = g.get('data_version')
+    if version is None: version = sync_grid_cache()
+    with grid_cache_lock:
+        for th in threads:
+            cached = grid_cache.get((th.thread_id, year))
+            if cached and cached[0] == today and cached[1] >= _grid_mark(th.thread_id, year):
+                result[th.thread_id] = cached[2]
+                grid_cache.move_to_end((th.thread_id, year))
+                grid_cache_stats['hits'] += 1
+            else:
+                missing.append(th)
+                grid_cache_stats['misses'] += 1
+    if not missing: return result
+
+    start_year = date(year, 1, 1)
+    end_year = date(year, 12, 31)
+    off_routine_days = {c.actual_date: True for c in Calendar.query.filter(
+        Calendar.off_routine_flag == True, Calendar.actual_date >= start_year, Calendar.actual_date <= end_year).all()}
+    with metrics.stage('squares_load'):
+        store = SquareStore.load([th.thread_id for th in missing], *cadence_window(missing, start_year, end_year))
+    cadence_index = build_cadence_index(missing, store, start_year, end_year)
+    for th in missing:
+        weeks = build_thread_weeks(th, start_year, end_year, store, off_routine_days, cadence_index, today)
+        result[th.thread_id] = weeks
+        with grid_cache_lock:
+            grid_cache[(th.thread_id, year)] = (today, version, weeks)
+            grid_cache.move_to_end((th.thread_id, year))
+            while len(grid_cache) > GRID_CACHE_SIZE: grid_cache.popitem(last=False)
+    return result
+
+MAX_VIEW_DAYS = 3 * 366
+
+def is_full_year(start, end):
+    return start == date(start.year, 1, 1) and end == date(start.year, 12, 31)
+
+MIN_VIEW_YEAR = 1970
+
+def parse_view_window(args, today):
+    # ?year=YYYY or ?start=YYYY-MM-DD&end=YYYY-MM-DD; defaults to the current year, as do invalid or far off dates
+    years = range(MIN_VIEW_YEAR, today.year + 2)
+    year = args.get('year', type=int)
+    if year not in years: year = None
+    try: start, end = _parse_date(args.get('start')), _parse_date(args.get('end'))
+    except ValueError: start = end = None
+    if start and end and not (start.year in years and end.year in years): start = end = None
+    if year or not (start and end):
+        year = year or today.year
+        return date(year, 1, 1), date(year, 12, 31)
+    if end < start: start, end = end, start
+    if (end - start).days >= MAX_VIEW_DAYS: start = end - timedelta(days=MAX_VIEW_DAYS - 1)
+    return start, end
+
+def get_window_grids(threads, start, end, today):
+    # range views are sliced out of the cached year grids of every year they touch
+    if is_full_year(start, end):
+        return get_year_grids(threads, start.year, today)
+    per_year = [get_year_grids(threads, year, today) for year in range(start.year, end.year + 1)]
+    lo, hi = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    result = {}
+    for th in threads:
+        days = [{'is_padding': True}] * start.weekday()
+        for grids in per_year:
+            days += [d for week in grids[th.thread_id] for d in week if not d['is_padding'] and lo <= d['date'] <= hi]
+        result[th.thread_id] = [days[i:i + 7] for i in range(0, len(days), 7)]
+    return result
+
+def iter_category_rows(threads, start, end, today):
+    # one category's rows, built only when the streamed template reaches that category
+    if not threads: return
+    with metrics.stage('grid_build'):
+        weeks_by_thread = get_window_grids(threads, start, end, today)
+    for th in threads:
+        yield {'info': th, 'weeks': weeks_by_thread.pop(th.thread_id)}
+
+def has_history_before(d_date):
+    first_square = db.session.query(func.min(Square.period)).filter(Square.status != 'empty').scalar()
+    first_thread = db.session.query(func.min(Thread.created_at)).scalar()
+    return any(x and x < d_date for x in (first_square, first_thread))
+
+def thread_row_payload(th, weeks):
+    # one char per day: '.' empty, 'h' hit, 'm' miss; fulfilled/off-routine as '0'/'1' strings
+    days = [d for week in weeks for d in week if not d['is_padding']]
+    return {
+        'id': th.thread_id, 'name': th.thread_name, 'rank': th.rank,
+        'category': th.category if th.category in CATEGORIES else 'frogs',
+        'sub_category': th.sub_category or "", 'cadence': th.cadence,
+        'days': "".join(STATUS_CODES.get(d['status'], '.') for d in days),
+        'fulfilled': "".join('1' if d['is_fulfilled'] else '0' for d in days),
+        'reasons': {i: d['miss_reason'] for i, d in enumerate(days) if d['miss_reason']}
+    }
+
 # --- BACKUP & RESTORE ---
-def create_full_backup_json():
-    data = {}
-    data['threads'] = [{
+BACKUP_FORMAT = "life-tracker-ndjson"
+BACKUP_YIELD_PER = 1000
+
+def _thread_row(t):
+    return {
         'thread_id': t.thread_id, 'thread_name': t.thread_name, 'category': t.category,
         'status': t.status, 'rank': t.rank, 'created_at': str(t.created_at),
         'created_at_40k': t.created_at_40k, 'closed_date': str(t.closed_date) if t.closed_date else None,
         'sub_category': t.sub_category, 'type': t.type, 'cadence': t.cadence,
-        'thread_name_redacted': t.thread_name_redacted
-    } for t in Thread.query.all()]
-    data['squares'] = [{
+        'thread_name_redacted': t.thread_name_redacted, 'updated_at': _iso(t.updated_at)
+    }
+
+def _square_row(s):
+    return {
         'square_id': s.square_id, 'thread_id': s.thread_id, 'period': str(s.period), 
         'status': s.status, 'chain_id': s.chain_id, 'chain_start': s.chain_start,
-        'chain_end': s.chain_end, 'chain_end_reason': s.chain_end_reason
-    } for s in Square.query.filter(Square.status != 'empty').all()]
-    data['calendar'] = [{
+        'chain_end': s.chain_end, 'chain_end_reason': s.chain_end_reason, 'updated_at': _iso(s.updated_at)
+    }
+
+def _calendar_row(c):
+    return {
         'actual_date': str(c.actual_date), 'date_40k': c.date_40k, 'week_40k': c.week_40k,
         'top_work_priority': c.top_work_priority, 'top_other_priority': c.top_other_priority,
         'off_routine_flag': c.off_routine_flag, 'off_routine_reason': c.off_routine_reason,
         'project_type_this_week': c.project_type_this_week, 'day_meds': c.day_meds,
-        'comments': c.comments
-    } for c in Calendar.query.all()]
-    data['board'] = [{'text': b.text} for b in BoardItem.query.all()]
-    data['chains'] = [{
+        'comments': c.comments, 'updated_at': _iso(c.updated_at)
+    }
+
+def _chain_row(c):
+    return {
         'chain_id': c.chain_id, 'thread_id': c.thread_id,
         'chain_start_date': str(c.chain_start_date), 'chain_end_date': str(c.chain_end_date),
         'duration': c.duration, 'end_reason': c.end_reason
-    } for c in Chain.query.all()]
+    }
+
+def _board_row(b):
+    return {'text': b.text, 'updated_at': _iso(b.updated_at)}
+
+def _comment_row(c):
+    return {'day': str(c.day), 'created_at': _iso(c.created_at), 'text': c.text}
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+def create_full_backup_json():
+    data = {}
+    data['threads'] = [_thread_row(t) for t in Thread.query.all()]
+    data['squares'] = [_square_row(s) for s in Square.query.filter(Square.status != 'empty').all()]
+    data['calendar'] = [_calendar_row(c) for c in Calendar.query.all()]
+    data['board'] = [_board_row(b) for b in BoardItem.query.all()]
+    data['day_comments'] = [_comment_row(c) for c in DayComment.query.order_by(DayComment.id).all()]
+    data['chains'] = [_chain_row(c) for c in Chain.query.all()]
     return json.dumps(data, indent=2, ensure_ascii=False)
 
-def restore_from_json(json_content):
+def iter_backup_records(since=None, comments_after=0, comments_upto=None):
+    # chains are derived data, restore recomputes them. With `since` only rows touched at or after it
+    # (empty squares included, so clearing a day survives), comments by id, and the whole board:
+    # it is a handful of rows and notes are hard-deleted, so a snapshot is simpler than tombstones.
+    def changed(q, model):
+        return q.filter(model.updated_at >= since) if since else q
+    squares = Square.query if since else Square.query.filter(Square.status != 'empty')
+    comments = DayComment.query.filter(DayComment.id > comments_after)
+    if comments_upto is not None: comments = comments.filter(DayComment.id <= comments_upto)
+    yield 'threads', (_thread_row(t) for t in changed(Thread.query, Thread).order_by(Thread.thread_id).yield_per(BACKUP_YIELD_PER))
+    yield 'squares', (_square_row(s) for s in changed(squares, Square).yield_per(BACKUP_YIELD_PER))
+    yield 'calendar', (_calendar_row(c) for c in changed(Calendar.query, Calendar).yield_per(BACKUP_YIELD_PER))
+    yield 'board', (_board_row(b) for b in BoardItem.query.order_by(BoardItem.id).yield_per(BACKUP_YIELD_PER))
+    yield 'day_comments', (_comment_row(c) for c in comments.order_by(DayComment.id).yield_per(BACKUP_YIELD_PER))
+
+# updated_at is stamped when a write's statement runs, not when it commits: a write in flight while the
+# mark is taken can commit after the export read its table. Deltas re-read this much before their `since`;
+# the overlap is harmless, threads, squares and calendar merge by primary key
+BACKUP_OVERLAP = timedelta(minutes=10)
+
+def backup_mark():
+    # taken before reading any rows; see BACKUP_OVERLAP for writes that are still in flight
+    return {'until': datetime.datetime.now().isoformat(), 'comment_id': db.session.query(func.max(DayComment.id)).scalar() or 0}
+
+def write_backup_stream(fileobj, since=None, mark=None):
+    # since: the mark of the previous backup -> delta; None -> full
+    mark = mark or backup_mark()
+    header = {'format': BACKUP_FORMAT, 'version': 1, 'kind': 'delta' if since else 'full', **mark}
+    if since: header['since'] = since['until']
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as gz:
+        gz.write((json.dumps(header) + "\n").encode('utf-8'))
+        records = iter_backup_records(datetime.datetime.fromisoformat(since['until']) - BACKUP_OVERLAP, since['comment_id'], mark['comment_id']) if since else iter_backup_records()
+        for table, rows in records:
+            for row in rows:
+                gz.write((json.dumps({'table': table, 'row': row}, ensure_ascii=False) + "\n").encode('utf-8'))
+    return header
+
+def create_backup_file(since=None):
+    out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    header = write_backup_stream(out, since)
+    out.seek(0)
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
+    return out, f"backup_{header['kind']}_{timestamp}.ndjson.gz", header
+
+def get_state(key, default=None):
+    row = db.session.get(AppState, key)
+    return json.loads(row.value) if row else default
+
+def set_state(key, value):
+    db.session.merge(AppState(key=key, value=json.dumps(value)))
+
+def load_backup(content):
+    # accepts the gzip NDJSON stream, plain NDJSON or the legacy single JSON document
+    if isinstance(content, bytes) and content[:2] == b'\x1f\x8b':
+        lines = io.TextIOWrapper(gzip.GzipFile(fileobj=io.BytesIO(content)), encoding='utf-8')
+    else:
+        if isinstance(content, bytes): content = content.decode('utf-8')
+        first = content.lstrip()[:200]
+        if BACKUP_FORMAT not in first.split("\n", 1)[0]:
+            return json.loads(content)
+        lines = io.StringIO(content)
+    header = json.loads(next(lines))
+    if header.get('format') != BACKUP_FORMAT: raise ValueError("unknown backup format")
+    data = {'header': header}
+    for line in lines:
+        if not line.strip(): continue
+        rec = json.loads(line)
+        data.setdefault(rec['table'], []).append(rec['row'])
+    return data
+
+RESTORE_CHUNK = 5000
+
+def _parse_datetime(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+def _bulk_insert(model, rows, progress=None, label=None):
+    for i in range(0, len(rows), RESTORE_CHUNK):
+        db.session.execute(model.__table__.insert(), rows[i:i + RESTORE_CHUNK])
+        if progress and label and len(rows) > RESTORE_CHUNK:
+            progress(f"{label}: {min(i + RESTORE_CHUNK, len(rows))}/{len(rows)}")
+
+BACKUP_KEYS = {'threads': 'thread_id', 'squares': 'square_id', 'calendar': 'actual_date'}
+
+def merge_backup(data, delta):
+    # applies a delta on top of parsed backup data, rows replaced by primary key
+    header = delta.get('header') or {}
+    if header.get('kind') != 'delta': raise ValueError("not a delta backup")
+    base_until = (data.get('header') or {}).get('until')
+    if base_until and header['since'] > base_until: raise ValueError(f"gap between backups: {base_until} .. {header['since']}")
+    for table, key in BACKUP_KEYS.items():
+        rows = {r[key]: r for r in data.get(table, [])}
+        rows.update((r[key], r) for r in delta.get(table, []))
+        data[table] = list(rows.values())
+    data['board'] = delta.get('board', [])
+    # comments are append-only and ids are renumbered by every restore, so they are matched by content:
+    # re-applying a delta, or applying one onto the database it came from, must not log them twice
+    seen = {(c['day'], c.get('created_at'), c['text']) for c in data.get('day_comments', [])}
+    data['day_comments'] = data.get('day_comments', []) + [
+        c for c in delta.get('day_comments', []) if (c['day'], c.get('created_at'), c['text']) not in seen]
+    data['header'] = {**(data.get('header') or {}), 'until': header['until']}
+    return data
+
+def current_backup_data():
+    # the live database as parsed backup data, the base for applying a lone delta; its `until` is the mark
+    # of the last restored backup, so a delta that skips one is refused by merge_backup
+    data = {'header': {'kind': 'full', 'until': (get_state('restore') or {}).get('until')}}
+    for table, rows in iter_backup_records():
+        data[table] = list(rows)
+    return data
+
+def restore_from_json(json_content, progress=None, deltas=()):
+    # json_content: a full backup (or a delta, applied on top of the current database); deltas: applied in order after it
     try:
-        data = json.loads(json_content)
+        data = load_backup(json_content)
+        if (data.get('header') or {}).get('kind') == 'delta':
+            deltas = [data, *deltas]
+            data = current_backup_data()
+        for delta in deltas:
+            merge_backup(data, load_backup(delta) if isinstance(delta, (bytes, str)) else delta)
+        threads = [{
+            'thread_id': t['thread_id'], 'thread_name': t['thread_name'], 'category': t['category'],
+            'status': t['status'], 'rank': t['rank'], 'created_at': _parse_date(t['created_at']),
+            'created_at_40k': t.get('created_at_40k'), 'closed_date': _parse_date(t.get('closed_date')),
+            'sub_category': t.get('sub_category'), 'type': t.get('type'),
+            'cadence': t.get('cadence'), 'thread_name_redacted': t.get('thread_name_redacted'),
+            'updated_at': _parse_datetime(t.get('updated_at'))
+        } for t in data.get('threads', [])]
+        squares = [{
+            'square_id': s['square_id'], 'thread_id': s['thread_id'], 'period': _parse_date(s['period']),
+            'status': s['status'], 'chain_id': None,
+            'chain_start': s.get('chain_start', False), 'chain_end': s.get('chain_end', False),
+            'chain_end_reason': s.get('chain_end_reason', ""), 'updated_at': _parse_datetime(s.get('updated_at'))
+        } for s in data.get('squares', [])]
+        calendar = [{
+            'actual_date': _parse_date(c['actual_date']), 'date_40k': c.get('date_40k'), 'week_40k': c.get('week_40k'),
+            'comments': c.get('comments'), 'top_work_priority': c.get('top_work_priority'),
+            'top_other_priority': c.get('top_other_priority'),
+            'project_type_this_week': c.get('project_type_this_week'),
+            'day_meds': c.get('day_meds', False),
+            'off_routine_flag': c.get('off_routine_flag', False),
+            'off_routine_reason': c.get('off_routine_reason', ""), 'updated_at': _parse_datetime(c.get('updated_at'))
+        } for c in data.get('calendar', [])]
+        board = [{'text': b['text'], 'updated_at': _parse_datetime(b.get('updated_at'))} for b in data.get('board', [])]
+        comments = [{
+            'day': _parse_date(c['day']), 'text': c['text'], 'created_at': _parse_datetime(c.get('created_at'))
+        } for c in data.get('day_comments', [])]
+        for cal in calendar:
+            # backups taken before day_comments existed keep the log in the calendar blob
+            comments.extend(split_comment_blob(cal['actual_date'], cal['comments']))
+            cal['comments'] = ""
+
+        # all chains in one in-memory pass over the parsed squares
+        tolerances = {t['thread_id']: CADENCE_TOLERANCE.get(t['cadence'], 1) for t in threads}
+        by_thread = {}
+        for sq in sorted(squares, key=lambda r: r['period']):
+            if sq['status'] in ('hit', 'miss'): by_thread.setdefault(sq['thread_id'], []).append(sq)
+        chains = []
+        for t_id, rows in by_thread.items():
+            hits = [r for r in rows if r['status'] == 'hit']
+            misses = [(r['period'], r['chain_end_reason']) for r in rows if r['status'] == 'miss']
+            thread_chains = compute_chains(t_id, tolerances.get(t_id, 1), [r['period'] for r in hits], misses)
+            i = 0
+            for r in hits:
+                while r['period'] > thread_chains[i]['chain_end_date']: i += 1
+                r['chain_id'] = thread_chains[i]['chain_id']
+            chains.extend(thread_chains)
+        if progress: progress(f"parsed: {len(threads)} threads, {len(squares)} squares, {len(chains)} chains")
+
         db.session.query(Square).delete()
         db.session.query(Chain).delete()
+        db.session.query(PeriodRollup).delete()
         db.session.query(BoardItem).delete()
         db.session.query(Calendar).delete()
+        db.session.query(DayComment).delete()
         db.session.query(Thread).delete()
+        # the restored rows keep their updated_at; the next scheduled backup is a full one
+        db.session.query(AppState).filter(AppState.key == 'backup').delete()
+        set_state('restore', {'until': (data.get('header') or {}).get('until')})
+        invalidate_grid_cache(version=bump_data_version('restore'))
+        _bulk_insert(Thread, threads)
+        _bulk_insert(Chain, chains)
+        _bulk_insert(Square, squares, progress, "squares")
+        _bulk_insert(Calendar, calendar, progress, "calendar")
+        _bulk_insert(BoardItem, board)
+        _bulk_insert(DayComment, comments, progress, "comments")
         db.session.commit()
-        
-        for t in data.get('threads', []):
-            dt = datetime.datetime.strptime(t['created_at'], '%Y-%m-%d').date()
-            closed = datetime.datetime.strptime(t['closed_date'], '%Y-%m-%d').date() if t.get('closed_date') else None
-            th = Thread(
-                thread_id=t['thread_id'], thread_name=t['thread_name'], category=t['category'],
-                status=t['status'], rank=t['rank'], created_at=dt, 
-                created_at_40k=t.get('created_at_40k'), closed_date=closed, 
-                sub_category=t.get('sub_category'), type=t.get('type'), 
-                cadence=t.get('cadence'), thread_name_redacted=t.get('thread_name_redacted')
-            )
-            db.session.add(th)
-        db.session.commit() 
-        
-        for s in data.get('squares', []):
-            d_date = datetime.datetime.strptime(s['period'], '%Y-%m-%d').date()
-            sq = Square(
-                square_id=s['square_id'], thread_id=s['thread_id'], period=d_date,
-                status=s['status'], chain_id=None,
-                chain_start=s.get('chain_start', False),
-                chain_end=s.get('chain_end', False), 
-                chain_end_reason=s.get('chain_end_reason', "")
-            )
-            db.session.add(sq)
-            
-        for c in data.get('calendar', []):
-            d_date = datetime.datetime.strptime(c['actual_date'], '%Y-%m-%d').date()
-            cal = Calendar(
-                actual_date=d_date, date_40k=c.get('date_40k'), week_40k=c.get('week_40k'),
-                comments=c.get('comments'), top_work_priority=c.get('top_work_priority'),
-                top_other_priority=c.get('top_other_priority'), 
-                project_type_this_week=c.get('project_type_this_week'),
-                day_meds=c.get('day_meds', False), 
-                off_routine_flag=c.get('off_routine_flag', False),
-                off_routine_reason=c.get('off_routine_reason', "")
-            )
-            db.session.add(cal)
-            
-        for b in data.get('board', []):
-            db.session.add(BoardItem(text=b['text']))
-            
-        db.session.commit()
-        
-        active_threads = Thread.query.all()
-        for th in active_threads:
-            recalculate_chains(th.thread_id)
-            
         return True, "Відновлено успішно."
     except Exception as e:
+        db.session.rollback()
         return False, str(e)
 
-def send_scheduled_backup():
-    admins = [chat_id for chat_id, role in user_sessions.items() if role == 'admin']
+def send_scheduled_backup(full=False):
+    # a delta since the last backup that reached the admins, or a full one if there is none or it is too old
+    admins = user_sessions.chats('admin')
     if not admins: return
     try:
         with app.app_context():
-            backup_content = create_full_backup_json()
-            timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
-            filename = f"backup_{timestamp}.json"
+            state = get_state('backup')
+            if state and not full:
+                full = (datetime.datetime.now() - datetime.datetime.fromisoformat(state['full_at'])).days >= BACKUP_FULL_EVERY_DAYS
+            backup_file, filename, header = create_backup_file(None if full or not state else state)
+        with backup_file:
             for admin_id in admins:
-                bot.send_document(admin_id, backup_content.encode('utf-8'), visible_file_name=filename, caption=f"📦 Full Backup (JSON)")
+                backup_file.seek(0)
+                bot.send_document(admin_id, backup_file, visible_file_name=filename, caption=f"📦 {header['kind'].title()} Backup (NDJSON.gz)")
+        with app.app_context():
+            mark = {'until': header['until'], 'comment_id': header['comment_id'],
+                    'full_at': header['until'] if header['kind'] == 'full' else state['full_at']}
+            set_state('backup', mark)
+            db.session.commit()
     except Exception as e:
         print(f"Backup failed: {e}")
 
 # --- BOT ---
-if bot:
+board_cursors = {}  # chat_id -> (search, cursor) of the last /list or /find page
+class SessionStore:
+    # bot logins live in bot_sessions; role lookups go through a per-process cache (misses cached too)
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def get(self, chat_id):
+        now = time.monotonic()
+        hit = self.cache.get(chat_id)
+        if hit and hit[1] > now: return hit[0]
+        with app.app_context():
+            row = db.session.get(BotSession, chat_id)
+            role = row.role if row else None
+        with self.lock: self.cache[chat_id] = (role, now + self.ttl)
+        return role
+
+    def set(self, chat_id, role):
+        with app.app_context():
+            db.session.merge(BotSession(chat_id=chat_id, role=role))
+            db.session.commit()
+        with self.lock: self.cache[chat_id] = (role, time.monotonic() + self.ttl)
+
+    def drop(self, chat_id):
+        with app.app_context():
+            existed = BotSession.query.filter_by(chat_id=chat_id).delete()
+            db.session.commit()
+        with self.lock: self.cache[chat_id] = (None, time.monotonic() + self.ttl)
+        return bool(existed)
+
+    def chats(self, role):
+        # always read from the table, the cache only knows chats that talked to this process
+        with app.app_context():
+            return [c for (c,) in db.session.query(BotSession.chat_id).filter_by(role=role).order_by(BotSession.chat_id)]
+
+user_sessions = SessionStore(SESSION_CACHE_TTL)
+
+def register_bot_handlers(bot):
     @bot.message_handler(commands=['start'])
     def send_welcome(message):
         bot.reply_to(message, "Enter your password:")
 
     @bot.message_handler(commands=['logout'])
     def handle_logout(message):
-        chat_id = message.chat.id
-        if chat_id in user_sessions:
-            user_sessions.pop(chat_id)
+        if user_sessions.drop(message.chat.id):
             bot.reply_to(message, "ok")
 
     @bot.message_handler(content_types=['document'])
@@ -327,15 +1344,17 @@ if bot:
         if user_sessions.get(message.chat.id) != "admin": return
         try:
             file_name = message.document.file_name
-            if not file_name.endswith('.json'):
-                bot.reply_to(message, "❌ I need an .json file")
+            if not file_name.endswith(('.json', '.ndjson', '.gz')):
+                bot.reply_to(message, "❌ I need an .json / .ndjson.gz file")
                 return
             file_info = bot.get_file(message.document.file_id)
-            downloaded_file = bot.download_file(file_info.file_path)
-            json_content = downloaded_file.decode('utf-8')
-            bot.reply_to(message, "⏳ restoring...")
+            json_content = bot.download_file(file_info.file_path)
+            status_msg = bot.reply_to(message, "⏳ restoring...")
+            def report(text):
+                try: bot.edit_message_text(f"⏳ {text}", message.chat.id, status_msg.message_id)
+                except Exception: pass
             with app.app_context():
-                success, msg = restore_from_json(json_content)
+                success, msg = restore_from_json(json_content, progress=report)
             if success:
                 bot.reply_to(message, "✅ Success.")
             else:
@@ -348,18 +1367,19 @@ if bot:
         chat_id = message.chat.id
         txt = message.text.strip()
         
-        if chat_id not in user_sessions:
+        role = user_sessions.get(chat_id)
+        if role is None:
             pwd_hash = hashlib.sha256(txt.encode()).hexdigest()
             if pwd_hash == HASH_USER:
-                user_sessions[chat_id] = "user"
+                user_sessions.set(chat_id, "user")
                 bot.reply_to(message, "✅ User Mode.")
             elif pwd_hash == HASH_ADMIN:
-                user_sessions[chat_id] = "admin"
+                user_sessions.set(chat_id, "admin")
                 bot.reply_to(message, "👨‍💻 Admin Mode.")
             else: bot.reply_to(message, "❌ wrong password.")
             return
         
-        if user_sessions[chat_id] == "user":
+        if role == "user":
             if txt.startswith('/del'):
                 parts = txt.split()
                 if len(parts) > 1 and parts[1].isdigit():
@@ -367,67 +1387,203 @@ if bot:
                         item = db.session.get(BoardItem, int(parts[1]))
                         if item:
                             db.session.delete(item)
+                            bump_data_version()
                             db.session.commit()
                             bot.reply_to(message, "🗑 ok.")
-            elif txt == "/list":
+            elif txt == "/stats":
+                with app.app_context():
+                    stats = compute_stats()
+                lines = [f"{t['name']}: 🔥{t['streaks']['current']} (best {t['streaks']['longest']}) · "
+                         f"{t['completion']['rolling'] * 100:.0f}% / {t['completion']['rate'] * 100:.0f}% all-time"
+                         for t in stats['threads']]
+                top = ", ".join(f"{r} ×{n}" for r, n in stats['miss_reasons'][:5])
+                bot.reply_to(message, "\n".join(lines + ([f"misses: {top}"] if top else [])) or "Empty.")
+            elif txt in ("/list", "/list next") or txt.startswith("/find"):
+                # /list: newest page, /list next: the page after the last one shown, /find <words>: search
+                if txt.startswith("/find"): board_cursors[chat_id] = (txt[5:].strip(), None)
+                elif txt == "/list": board_cursors[chat_id] = (None, None)
+                q, cursor = board_cursors.get(chat_id, (None, None))
+                if txt == "/list next" and chat_id in board_cursors and cursor is None:
+                    bot.reply_to(message, "That's all.")
+                    return
                 with app.app_context():
-                    items = BoardItem.query.order_by(BoardItem.id.desc()).all()
-                    msg = "\n".join([f"{item.id}. {item.text}" for item in items]) if items else "Empty."
-                    bot.reply_to(message, msg)
+                    items, cursor = board_page(cursor, q=q)
+                board_cursors[chat_id] = (q, cursor)
+                msg = "\n".join(f"{item.id}. {item.text}" for item in items) if items else "Empty."
+                if cursor: msg += "\n… /list next"
+                bot.reply_to(message, msg[:4000])
+            elif txt.startswith("/log"):
+                # /log <thread_id> <hit|miss|empty> <dates> [reason]
+                parts = txt.split(maxsplit=4)
+                try:
+                    if len(parts) < 4 or not parts[1].isdigit(): raise ValueError("usage: /log <thread_id> <hit|miss|empty> <2026-10-01..2026-10-07|today|-1> [reason]")
+                    dates = parse_bulk_dates(parts[3], date.today())
+                    with app.app_context():
+                        if not db.session.get(Thread, int(parts[1])): raise ValueError("no such thread")
+                        count = apply_square_updates([(parts[1], d, parts[2], parts[4] if len(parts) > 4 else "") for d in dates])
+                    bot.reply_to(message, f"✅ {count} squares.")
+                except Exception as e:
+                    bot.reply_to(message, f"❌ {e}")
             elif txt.startswith("/b "):
                 note = txt[3:].strip()
                 with app.app_context():
                     db.session.add(BoardItem(text=note))
+                    bump_data_version()
                     db.session.commit()
                     bot.reply_to(message, "📌 added.")
             else:
                 try:
                     with app.app_context():
-                        cal = ensure_calendar_entry(date.today())
-                        timestamp = datetime.datetime.now().strftime("%H:%M")
-                        entry = f"[{timestamp}] {txt}"
-                        if cal.comments: cal.comments += "\n" + entry
-                        else: cal.comments = entry
+                        ensure_calendar_entry(date.today())
+                        add_day_comment(date.today(), txt)
+                        bump_data_version()
                         db.session.commit()
                     bot.reply_to(message, "🐦 saved.")
                 except Exception as e:
                     bot.reply_to(message, f"DB Error: {e}")
                 
-        elif user_sessions[chat_id] == "admin":
-            if txt == "/backup":
-                send_scheduled_backup()
+        elif role == "admin":
+            if txt in ("/backup", "/backup full"):
+                # /backup sends the same delta-or-full the nightly job would, /backup full forces a full one
+                send_scheduled_backup(full=txt.endswith("full"))
+            elif txt == "/botstats":
+                m = bot_dispatcher.metrics()
+                bot.reply_to(message, f"queues: {m['queue_depth']}\nhandled: {m['handled']} (errors {m['errors']}, rejected {m['rejected']})\n"
+                                      f"latency avg {m['latency_avg']:.3f}s / max {m['latency_max']:.3f}s")
             else:
                 bot.reply_to(message, "bro, where is json")
 
+class BotDispatcher:
+    # one bounded FIFO lane per worker; a chat always maps to the same lane so its messages stay ordered
+    def __init__(self, tg_bot, workers, queue_size):
+        self.bot = tg_bot
+        self.lanes = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.stats = {'handled': 0, 'errors': 0, 'rejected': 0, 'latency_sum': 0.0, 'latency_max': 0.0}
+
+    def start(self):
+        for i, lane in enumerate(self.lanes):
+            threading.Thread(target=self._work, args=(lane,), name=f"BotWorker-{i}", daemon=True).start()
+
+    def submit(self, update):
+        message = update.message or update.edited_message
+        chat_id = message.chat.id if message else 0
+        try:
+            # never block here: this runs on the single polling thread, a wait would stall every other chat
+            self.lanes[hash(chat_id) % len(self.lanes)].put_nowait(update)
+        except queue.Full:
+            with self.lock: self.stats['rejected'] += 1
+            if message:
+                try: self.bot.reply_to(message, "⏳ busy, try again in a minute.")
+                except Exception: pass
+
+    def _work(self, lane):
+        while True:
+            update = lane.get()
+            t0 = time.perf_counter()
+            failed = False
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                failed = True
+                print(f"Bot handler error: {e}")
+            elapsed = time.perf_counter() - t0
+            if metrics.ENABLED: metrics.registry.observe('bot_update_duration_seconds', elapsed, command=_update_kind(update))
+            with self.lock:
+                self.stats['handled'] += 1
+                self.stats['errors'] += failed
+                self.stats['latency_sum'] += elapsed
+                self.stats['latency_max'] = max(self.stats['latency_max'], elapsed)
+            lane.task_done()
+
+    def metrics(self):
+        with self.lock: data = dict(self.stats)
+        data['queue_depth'] = [lane.qsize() for lane in self.lanes]
+        data['latency_avg'] = data['latency_sum'] / data['handled'] if data['handled'] else 0.0
+        return data
+
+BOT_COMMANDS = {'/start', '/logout', '/list', '/find', '/log', '/b', '/del', '/stats', '/backup', '/botstats'}
+
+def _update_kind(update):
+    # label by known command only: free text or made-up commands (from any chat, before login) would blow up the series count
+    message = update.message or update.edited_message
+    if not message: return 'other'
+    if message.content_type != 'text': return message.content_type
+    word = (message.text or "").split(maxsplit=1)[0] if (message.text or "").strip() else ""
+    if not word.startswith('/'): return 'text'
+    word = word.split('@')[0]
+    return word if word in BOT_COMMANDS else 'other'
+
+def init_bot():
+    # telebot is only imported by the process that actually polls
+    global bot, bot_dispatcher
+    if bot or not TG_BOT_TOKEN or "YOUR_LOCAL" in TG_BOT_TOKEN: return bot
+    import telebot
+    # handlers run inline on our own worker lanes, see BotDispatcher
+    bot = telebot.TeleBot(TG_BOT_TOKEN, threaded=False)
+    register_bot_handlers(bot)
+    bot_dispatcher = BotDispatcher(bot, BOT_WORKERS, BOT_QUEUE_SIZE)
+    return bot
+
 def run_bot_thread():
     if bot:
-        try:
-            print("Bot polling started...")
-            bot.polling(none_stop=True)
-        except Exception as e:
-            print(f"Bot crash: {e}")
+        bot_dispatcher.start()
+        print("Bot polling started...")
+        offset = None
+        while True:
+            try:
+                for update in bot.get_updates(offset=offset, timeout=20, long_polling_timeout=20):
+                    offset = update.update_id + 1
+                    bot_dispatcher.submit(update)
+            except Exception as e:
+                print(f"Bot polling error: {e}")
+                time.sleep(3)
 
 # --- WEB ROUTES ---
-@app.route('/')
+CALENDAR_WRITE_ATTEMPTS = 10
+
+@bp.before_app_request
+def _start_request_metrics():
+    if metrics.ENABLED: metrics.registry.begin()
+
+@bp.after_app_request
+def _record_request_metrics(response):
+    if not metrics.ENABLED or metrics.registry.scope()[0] is None: return response
+    labels = (request.endpoint or 'unknown', request.method, response.status_code)
+    if response.is_streamed:
+        # the body (grid build, render) is produced after this hook: close the scope when the stream ends.
+        # Headers are already out by then, so streamed pages get no Server-Timing
+        response.call_on_close(lambda: _finish_request_metrics(*labels))
+        return response
+    elapsed, queries, query_time = _finish_request_metrics(*labels)
+    response.headers['Server-Timing'] = f'db;dur={query_time * 1000:.1f};desc="{queries} queries", total;dur={elapsed * 1000:.1f}'
+    return response
+
+def _finish_request_metrics(endpoint, method, status):
+    started, queries, query_time = metrics.registry.scope()
+    metrics.registry.end()
+    elapsed = time.perf_counter() - started
+    metrics.registry.observe('http_request_duration_seconds', elapsed, endpoint=endpoint, method=method, status=status)
+    metrics.registry.observe('http_request_queries', queries, endpoint=endpoint)
+    return elapsed, queries, query_time
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics.registry.query(time.perf_counter() - conn.info['query_start'].pop())
+
+@bp.route('/')
 def index():
     try:
         today = date.today()
-        cal = ensure_calendar_entry(today)
-        raw_comments = cal.comments or ""
-        parsed_comments = []
-        lines = [c for c in raw_comments.split('\n') if c.strip()]
-        for line in lines:
-            if line.startswith('[') and ']' in line:
-                end_bracket = line.find(']')
-                time_str = line[1:end_bracket]
-                text_str = line[end_bracket+1:].strip()
-                parsed_comments.append({'time': time_str, 'text': text_str})
-            else:
-                parsed_comments.append({'time': '', 'text': line})
-        parsed_comments.reverse()
-
-        board_items = BoardItem.query.order_by(BoardItem.id.desc()).all()
-        board_data = [{'id': b.id, 'text': b.text} for b in board_items]
+        etag = _view_etag(sync_grid_cache(), today)
+        if request.if_none_match.contains(etag): return _cacheable(Response(status=304), etag)
+        with metrics.stage('day_context'):
+            cal = ensure_calendar_entry(today)
+            db.session.commit()
+            parsed_comments = [{'time': c.created_at.strftime('%H:%M') if c.created_at else '', 'text': c.text}
+                               for c in reversed(day_comments(today))]
 
         ctx = {
             'top_work': cal.top_work_priority or "",
@@ -437,105 +1593,228 @@ def index():
             'off_routine': cal.off_routine_flag,
             'off_reason': cal.off_routine_reason or "",
             'comment_list': parsed_comments,
-            'board_data': board_data,
             'date_40k': cal.date_40k,
-            'week_40k': cal.week_40k
+            'week_40k': cal.week_40k,
+            'version': cal.version
         }
 
-        categories = ['work', 'self care', 'home and family', 'frogs']
+        categories = CATEGORIES
         threads = Thread.query.filter(Thread.status == 'active').order_by(Thread.rank.desc()).all()
-        grouped_threads = {c: [] for c in categories}
-        start_year = date(today.year, 1, 1)
-        end_year = date(today.year, 12, 31)
-        
-        off_routine_days = {c.actual_date: True for c in Calendar.query.filter(Calendar.off_routine_flag == True).all()}
-        all_squares = Square.query.filter(Square.period >= start_year, Square.period <= end_year).all()
-        sq_map = {(s.thread_id, s.period): s for s in all_squares}
-        
+        threads_by_cat = {c: [] for c in categories}
         for th in threads:
-            cat = th.category if th.category in grouped_threads else 'frogs'
-            days = []
-            start_weekday = start_year.weekday() 
-            for _ in range(start_weekday): days.append({'is_padding': True})
-            delta = end_year - start_year
-            for i in range(delta.days + 1):
-                curr = start_year + timedelta(days=i)
-                sq = sq_map.get((th.thread_id, curr))
-                status = sq.status if sq else 'empty'
-                is_off = off_routine_days.get(curr, False)
-                is_fulfilled = is_day_fulfilled(th, curr, sq_map)
-                days.append({
-    'date': curr.strftime('%Y-%m-%d'), 
-    'is_today': (curr == today), 
-    'status': status, 
-    'is_off_routine': is_off, 
-    'is_fulfilled': is_fulfilled, 
-    'is_padding': False,
-    'miss_reason': sq.chain_end_reason if sq else ""
-})
-            weeks = [days[i:i + 7] for i in range(0, len(days), 7)]
-            grouped_threads[cat].append({'info': th, 'weeks': weeks})
-        return render_template('dashboard.html', grouped_threads=grouped_threads, categories=categories, ctx=ctx, today_date=today.strftime('%Y-%m-%d'))
-    except Exception as e: return f"CRITICAL ERROR: {str(e)}"
-
-@app.route('/api/get_day_info', methods=['POST'])
+            threads_by_cat[th.category if th.category in threads_by_cat else 'frogs'].append(th)
+        view_start, view_end = parse_view_window(request.args, today)
+        grouped_threads = {c: iter_category_rows(threads_by_cat[c], view_start, view_end, today) for c in categories}
+        view = {
+            'start': view_start.strftime('%Y-%m-%d'), 'end': view_end.strftime('%Y-%m-%d'),
+            'year': view_start.year if is_full_year(view_start, view_end) else None,
+            'has_more': has_history_before(view_start)
+        }
+        page = _stream_page('dashboard.html', grouped_threads=grouped_threads, categories=categories, ctx=ctx, view=view,
+                            today_date=today.strftime('%Y-%m-%d'), stream_flush=STREAM_FLUSH)
+        return _cacheable(Response(stream_with_context(page), mimetype='text/html'), etag)
+    except Exception as e:
+        print(f"Dashboard error: {e}")
+        if metrics.ENABLED: metrics.registry.inc('app_errors_total', where='index')
+        return f"CRITICAL ERROR: {str(e)}", 500
+
+def _view_etag(version, today):
+    # everything a grid view depends on: the data, the day (today marker, open periods) and the window asked for
+    return f"v{version}-{today:%Y%m%d}-{hashlib.md5(request.query_string).hexdigest()[:8]}"
+
+def _cacheable(response, etag):
+    # no-cache: the browser keeps the body but asks every time, unchanged data costs a 304
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+STREAM_FLUSH = "<!-- flush -->"
+STREAM_CHUNK = 2000
+
+def _stream_page(template_name, **context):
+    # Jinja yields one tiny string per template node; they are sent in batches of STREAM_CHUNK pieces,
+    # or early when the template outputs the flush marker (end of the page head, end of each category)
+    current_app.update_template_context(context)
+    chunks = current_app.jinja_env.get_template(template_name).generate(context)
+    buf = []
+    try:
+        with metrics.stage('render'):
+            for chunk in chunks:
+                buf.append(chunk)
+                if len(buf) >= STREAM_CHUNK or chunk == STREAM_FLUSH:
+                    yield "".join(buf)
+                    buf = []
+    except Exception as e:
+        # headers are gone by now, all that is left is to say so in the page
+        print(f"Dashboard error: {e}")
+        if metrics.ENABLED: metrics.registry.inc('app_errors_total', where='index')
+        buf.append(f"CRITICAL ERROR: {str(e)}")
+    if buf: yield "".join(buf)
+
+def _grid_meta(start, end, today):
+    off_days = {c.actual_date for c in Calendar.query.filter(
+        Calendar.off_routine_flag == True, Calendar.actual_date >= start, Calendar.actual_date <= end).all()}
+    n_days = (end - start).days + 1
+    return {
+        'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d'), 'start_weekday': start.weekday(),
+        'today': today.strftime('%Y-%m-%d'),
+        'off': "".join('1' if start + timedelta(days=i) in off_days else '0' for i in range(n_days))
+    }
+
+@bp.route('/api/grid')
+def api_grid():
+    today = date.today()
+    etag = _view_etag(sync_grid_cache(), today)
+    if request.if_none_match.contains(etag): return _cacheable(Response(status=304), etag)
+    start, end = parse_view_window(request.args, today)
+    threads = Thread.query.filter(Thread.status == 'active').order_by(Thread.rank.desc()).all()
+    weeks_by_thread = get_window_grids(threads, start, end, today)
+    payload = _grid_meta(start, end, today)
+    payload['has_more'] = has_history_before(start)
+    payload['threads'] = [thread_row_payload(th, weeks_by_thread[th.thread_id]) for th in threads]
+    return _cacheable(jsonify(payload), etag)
+
+@bp.route('/api/thread/<int:thread_id>/row')
+def api_thread_row(thread_id):
+    th = db.session.get(Thread, thread_id)
+    if not th or th.status != 'active': return jsonify({'success': False}), 404
+    sync_grid_cache()
+    today = date.today()
+    start, end = parse_view_window(request.args, today)
+    weeks = get_window_grids([th], start, end, today)[thread_id]
+    payload = _grid_meta(start, end, today)
+    payload['thread'] = thread_row_payload(th, weeks)
+    return jsonify(payload)
+
+@bp.route('/api/stats')
+def api_stats():
+    t0 = time.perf_counter()
+    ids = [int(x) for x in request.args.get('thread_id', '').split(',') if x.strip().isdigit()]
+    stats = compute_stats(ids or None)
+    stats['elapsed'] = round(time.perf_counter() - t0, 4)
+    return jsonify(stats)
+
+@bp.route('/api/cache_stats')
+def cache_stats():
+    with grid_cache_lock:
+        return jsonify({'entries': len(grid_cache), **grid_cache_stats})
+
+@bp.route('/api/metrics')
+def api_metrics():
+    # Prometheus text exposition; request/SQL/stage series only appear with METRICS=1
+    with grid_cache_lock:
+        gauges = [('grid_cache_entries', 'gauge', 'Cached (thread, year) grids.', len(grid_cache), {}),
+                  ('grid_cache_hits_total', 'counter', 'Grid cache hits.', grid_cache_stats['hits'], {}),
+                  ('grid_cache_misses_total', 'counter', 'Grid cache misses.', grid_cache_stats['misses'], {})]
+    if bot_dispatcher:
+        m = bot_dispatcher.metrics()
+        gauges += [('bot_queue_depth', 'gauge', 'Pending updates per worker lane.', depth, {'lane': i})
+                   for i, depth in enumerate(m['queue_depth'])]
+        gauges += [(f'bot_updates_{k}_total', 'counter', f'Telegram updates {k}.', m[k], {}) for k in ('handled', 'errors', 'rejected')]
+        gauges.append(('bot_update_latency_max_seconds', 'gauge', 'Slowest handled update.', m['latency_max'], {}))
+    return Response(metrics.registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/board')
+def api_board():
+    # ?cursor=<id from the previous page>&q=<search>&limit=
+    limit = min(request.args.get('limit', BOARD_PAGE_SIZE, type=int), 100)
+    items, cursor = board_page(request.args.get('cursor', type=int), max(limit, 1), request.args.get('q'))
+    return jsonify({'items': [{'id': b.id, 'text': b.text} for b in items], 'cursor': cursor})
+
+def _day_info(d_date, cal):
+    comments = "\n".join(format_comment(c) for c in day_comments(d_date))
+    if cal:
+        return {
+            'success': True,
+            'comments': comments,
+            'work': cal.top_work_priority or "",
+            'other': cal.top_other_priority or "",
+            'project': cal.project_type_this_week or "",
+            'meds': cal.day_meds,
+            'off': cal.off_routine_flag,
+            'off_reason': cal.off_routine_reason or "",
+            'version': cal.version
+        }
+    return {'success': True, 'comments': comments or "No data for this day.", 'work':"", 'other':"", 'project':"", 'meds':False, 'off':False, 'off_reason':""}
+
+@bp.route('/api/day_info')
+def day_info():
+    # GET /api/day_info?date=YYYY-MM-DD, revalidated per date: the calendar row's version, the day's newest
+    # comment (they are append-only) and the restore counter cover every way its answer can change
+    try:
+        d_date = datetime.datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+        cal = db.session.get(Calendar, d_date)
+        last_comment = db.session.query(func.max(DayComment.id)).filter(DayComment.day == d_date).scalar() or 0
+        etag = f"d{d_date:%Y%m%d}-{data_version('restore')}-{cal.version if cal else 0}-{last_comment}"
+        if request.if_none_match.contains(etag): return _cacheable(Response(status=304), etag)
+        return _cacheable(jsonify(_day_info(d_date, cal)), etag)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@bp.route('/api/get_day_info', methods=['POST'])
 def get_day_info():
     d_str = request.json.get('date')
     try:
         d_date = datetime.datetime.strptime(d_str, '%Y-%m-%d').date()
-        cal = db.session.get(Calendar, d_date)
-        if cal:
-            return jsonify({
-                'success': True,
-                'comments': cal.comments or "",
-                'work': cal.top_work_priority or "",
-                'other': cal.top_other_priority or "",
-                'project': cal.project_type_this_week or "",
-                'meds': cal.day_meds,
-                'off': cal.off_routine_flag,
-                'off_reason': cal.off_routine_reason or ""
-            })
-        else:
-            return jsonify({'success': True, 'comments': "No data for this day.", 'work':"", 'other':"", 'project':"", 'meds':False, 'off':False, 'off_reason':""})
+        return jsonify(_day_info(d_date, db.session.get(Calendar, d_date)))
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/update_day_context', methods=['POST'])
+@bp.route('/api/update_day_context', methods=['POST'])
 def update_day_context():
+    # 'version' (optional) is the calendar version the form was loaded with; a newer row answers 409
     data = request.json
-    cal = ensure_calendar_entry(date.today())
-    if 'top_work' in data: cal.top_work_priority = data['top_work']
-    if 'top_other' in data: cal.top_other_priority = data['top_other']
-    if 'project' in data: cal.project_type_this_week = data['project']
-    if 'meds' in data: cal.day_meds = data['meds']
-    if 'off_routine' in data: cal.off_routine_flag = data['off_routine']
-    if 'off_reason' in data: cal.off_routine_reason = data['off_reason']
-    if 'comments' in data and data['comments']:
-        timestamp = datetime.datetime.now().strftime("%H:%M")
-        new_entry = f"[{timestamp}] {data['comments']}"
-        if cal.comments: cal.comments += "\n" + new_entry
-        else: cal.comments = new_entry
-    db.session.commit()
-    return jsonify({'success': True})
+    for attempt in range(CALENDAR_WRITE_ATTEMPTS):
+        try:
+            cal = ensure_calendar_entry(date.today())
+            if data.get('version') is not None and data['version'] != cal.version:
+                db.session.rollback()
+                return jsonify({'success': False, 'error': 'changed elsewhere', 'version': cal.version}), 409
+            if 'top_work' in data: cal.top_work_priority = data['top_work']
+            if 'top_other' in data: cal.top_other_priority = data['top_other']
+            if 'project' in data: cal.project_type_this_week = data['project']
+            if 'meds' in data: cal.day_meds = data['meds']
+            off_changed = 'off_routine' in data and bool(data['off_routine']) != bool(cal.off_routine_flag)
+            if 'off_routine' in data: cal.off_routine_flag = data['off_routine']
+            if 'off_reason' in data: cal.off_routine_reason = data['off_reason']
+            if 'comments' in data and data['comments']: add_day_comment(cal.actual_date, data['comments'])
+            db.session.flush()
+            version = bump_data_version()
+            if off_changed: invalidate_grid_cache(year=cal.actual_date.year, version=version)
+            db.session.commit()
+            break
+        except StaleDataError:
+            # another writer committed this day in between: reload and apply the request on top of it
+            db.session.rollback()
+            time.sleep(0.005 * (attempt + 1))
+    else:
+        return jsonify({'success': False, 'error': 'busy, try again'}), 409
+    return jsonify({'success': True, 'version': cal.version})
 
-@app.route('/api/toggle_status', methods=['POST'])
+@bp.route('/api/toggle_status', methods=['POST'])
 def toggle_status():
+    # one upsert, so concurrent first clicks on the same day can't both insert
     data = request.json
-    t_id = data.get('thread_id')
-    d_str = data.get('date')
-    d_date = datetime.datetime.strptime(d_str, '%Y-%m-%d').date()
-    sq_id = f"{t_id}_{d_str}"
-    sq = db.session.get(Square, sq_id)
-    if not sq:
-        sq = Square(square_id=sq_id, thread_id=t_id, period=d_date)
-        db.session.add(sq)
-    sq.status = data.get('status')
-    sq.chain_end_reason = data.get('miss_reason', '') if sq.status == 'miss' else ""
-    db.session.commit()
-    recalculate_chains(t_id)
-    return jsonify({'success': True})
+    try:
+        d_date = datetime.datetime.strptime(data.get('date'), '%Y-%m-%d').date()
+        apply_square_updates([(data.get('thread_id'), d_date, data.get('status'), data.get('miss_reason', ''))])
+        return jsonify({'success': True})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+@bp.route('/api/toggle_status_batch', methods=['POST'])
+def toggle_status_batch():
+    try:
+        items = [(i.get('thread_id'), datetime.datetime.strptime(i.get('date'), '%Y-%m-%d').date(),
+                  i.get('status'), i.get('miss_reason', '')) for i in request.json.get('items', [])]
+        count = apply_square_updates(items)
+        return jsonify({'success': True, 'updated': count})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/add_thread', methods=['POST'])
+@bp.route('/api/add_thread', methods=['POST'])
 def add_thread():
     try:
         data = request.json
@@ -548,22 +1827,24 @@ def add_thread():
             status='active', rank=max_rank + 1, created_at=today, created_at_40k=get_date_40k(today)
         )
         db.session.add(new_th)
+        bump_data_version()
         db.session.commit()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'id': new_th.thread_id})
     except Exception as e: return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/delete_thread', methods=['POST'])
+@bp.route('/api/delete_thread', methods=['POST'])
 def delete_thread():
     t_id = request.json.get('id')
     thread = db.session.get(Thread, t_id)
     if thread:
         thread.status = 'deleted'
         thread.closed_date = date.today()
+        invalidate_grid_cache(t_id, version=bump_data_version())
         db.session.commit()
         return jsonify({'success': True})
     return jsonify({'success': False})
 
-@app.route('/api/move_thread', methods=['POST'])
+@bp.route('/api/move_thread', methods=['POST'])
 def move_thread():
     t_id = request.json.get('id')
     direction = request.json.get('direction')
@@ -573,23 +1854,71 @@ def move_thread():
         neighbor = Thread.query.filter(Thread.rank > thread.rank, Thread.status == 'active').order_by(Thread.rank.asc()).first()
     else:
         neighbor = Thread.query.filter(Thread.rank < thread.rank, Thread.status == 'active').order_by(Thread.rank.desc()).first()
-    if neighbor:
-        thread.rank, neighbor.rank = neighbor.rank, thread.rank
-        db.session.commit()
-    return jsonify({'success': True})
+    if not neighbor: return jsonify({'success': True, 'neighbor_id': None})
+    thread.rank, neighbor.rank = neighbor.rank, thread.rank
+    bump_data_version()
+    db.session.commit()
+    return jsonify({'success': True, 'neighbor_id': neighbor.thread_id})
 
 # --- STARTUP LOGIC ---
-with app.app_context():
-    db.create_all()
-    scheduler.init_app(app)
+def _file_lock(path, blocking=True):
+    # advisory lock on a local file; returns the open handle (the lock lives as long as it does) or None if taken
+    f = open(path, 'a')
+    try: import fcntl
+    except ImportError: return f
+    try: fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        f.close()
+        return None
+    return f
+
+_background_lock = None
+
+def start_background(flask_app):
+    global scheduler
+    from flask_apscheduler import APScheduler
+    scheduler = APScheduler()
+    scheduler.init_app(flask_app)
     scheduler.start()
     if not scheduler.get_job('auto_backup'):
         scheduler.add_job(id='auto_backup', func=send_scheduled_backup, trigger='cron', hour=23, minute=59)
+    if not scheduler.get_job('period_rollups'):
+        # once at startup too, so a fresh or restored database doesn't wait a night for its rollups
+        scheduler.add_job(id='period_rollups', func=rollup_closed_periods, trigger='cron', hour=0, minute=5,
+                          next_run_time=datetime.datetime.now())
+    if init_bot() and not any(t.name == "BotThread" for t in threading.enumerate()):
+        t = threading.Thread(target=run_bot_thread, name="BotThread")
+        t.daemon = True
+        t.start()
+
+def create_app(role=None):
+    global app, _background_lock
+    role = role or APP_ROLE
+    flask_app = Flask(__name__)
+    flask_app.config.from_object(Config())
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    db.init_app(flask_app)
+    flask_app.register_blueprint(bp)
+    app = flask_app
+    with flask_app.app_context():
+        if metrics.ENABLED:
+            event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+        # workers booting together take turns, the first one applies pending migrations
+        migrate_lock = _file_lock(BACKGROUND_LOCK + ".migrate")
+        try: run_migrations()
+        finally: migrate_lock.close()
+    if role == 'background':
+        start_background(flask_app)
+    elif role == 'auto' and _background_lock is None:
+        _background_lock = _file_lock(BACKGROUND_LOCK, blocking=False)
+        if _background_lock: start_background(flask_app)
+    return flask_app
 
-if not any(t.name == "BotThread" for t in threading.enumerate()):
-    t = threading.Thread(target=run_bot_thread, name="BotThread")
-    t.daemon = True
-    t.start()
+app = create_app()
 
 if __name__ == '__main__':
+    if APP_ROLE == 'background':
+        print("Background role: bot + scheduler only")
+        threading.Event().wait()
     app.run(host='0.0.0.0', port=8000, debug=False, use_reloader=False)
@@ -0,0 +1,297 @@
+import os
+import sys
+import io
+import json
+import time
+import random
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import date, datetime, timedelta
+
+# run against a throwaway sqlite file, never the real tracker db
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+os.environ.pop('TG_BOT_TOKEN', None)
+os.environ['APP_ROLE'] = 'web'
+
+import app as tracker
+from app import app, db, Thread, Square, Chain, Calendar, DayComment
+from sqlalchemy import func, insert
+
+CADENCES = ['yearly', 'quarterly', 'monthly', 'weekly', '3x_week', 'daily']
+MISS_REASONS = ["sick", "travel", "work late", "forgot", "no time", ""]
+
+def seed(n_threads, year, cadences=CADENCES, hit_rate=0.3):
+    generate(n_threads, years=1, end_year=year, cadences=cadences, hit_rate=hit_rate, streaky=False, calendar=False)
+
+def generate(n_threads, years=1, end_year=None, cadences=CADENCES, hit_rate=0.3, streaky=True, calendar=True, rnd_seed=42):
+    # wipes the bench db and fills it with n_threads threads over `years` years ending with end_year.
+    # streaky: hits follow a two-state Markov chain (runs of hits and gaps), with a miss logged on
+    # some of the days a run breaks; calendar: a Calendar row per day, ~5% off routine, some comments.
+    rnd = random.Random(rnd_seed)
+    end_year = end_year or date.today().year
+    start = date(end_year - years + 1, 1, 1)
+    n_days = (date(end_year, 12, 31) - start).days + 1
+    for model in (Chain, Square, tracker.PeriodRollup, Thread, Calendar, DayComment):
+        db.session.query(model).delete()
+    db.session.commit()
+    tracker.invalidate_grid_cache()
+
+    threads, squares = [], []
+    for i in range(n_threads):
+        t_id = i + 1
+        threads.append({'thread_id': t_id, 'thread_name': f"bench {i}", 'category': tracker.CATEGORIES[i % len(tracker.CATEGORIES)],
+                        'status': 'active', 'rank': t_id, 'cadence': cadences[i % len(cadences)]})
+        stay = 0.8
+        p_start = hit_rate * (1 - stay) / (1 - hit_rate) if hit_rate < 1 else 1
+        hit = False
+        for d in range(n_days):
+            curr = start + timedelta(days=d)
+            if streaky:
+                was_hit = hit
+                hit = rnd.random() < (stay if hit else p_start)
+                if hit: status = 'hit'
+                elif was_hit and rnd.random() < 0.5: status = 'miss'
+                elif rnd.random() < 0.02: status = 'miss'
+                else: continue
+            else:
+                r = rnd.random()
+                if r < hit_rate: status = 'hit'
+                elif r < hit_rate + 0.05: status = 'miss'
+                else: continue
+            squares.append({'square_id': f"{t_id}_{curr}", 'thread_id': t_id, 'period': curr, 'status': status,
+                            'chain_end_reason': rnd.choice(MISS_REASONS) if status == 'miss' else ""})
+    db.session.execute(insert(Thread), threads)
+    for i in range(0, len(squares), 5000):
+        db.session.execute(insert(Square), squares[i:i + 5000])
+
+    if calendar:
+        days, comments = [], []
+        for d in range(n_days):
+            curr = start + timedelta(days=d)
+            off = rnd.random() < 0.05
+            days.append({'actual_date': curr, 'date_40k': tracker.get_date_40k(curr), 'week_40k': curr.isocalendar()[1],
+                         'day_meds': rnd.random() < 0.5, 'off_routine_flag': off, 'off_routine_reason': "bench" if off else ""})
+            for k in range(rnd.choice((0, 0, 1, 2))):
+                comments.append({'day': curr, 'text': f"bench note {k}", 'created_at': datetime.combine(curr, datetime.min.time())})
+        db.session.execute(insert(Calendar), days)
+        if comments: db.session.execute(insert(DayComment), comments)
+    db.session.commit()
+    for t in threads: tracker.rebuild_chains(t['thread_id'])
+    db.session.commit()
+    return len(squares)
+
+def time_render(client, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        resp = client.get('/')
+        body = resp.get_data()  # the page is streamed, rendering happens while it is read
+        elapsed = time.perf_counter() - t0
+        assert resp.status_code == 200 and b'CRITICAL ERROR' not in body, body[:200]
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def time_fulfilment(threads, year, use_index):
+    store = tracker.SquareStore.load(start=date(year, 1, 1), end=date(year, 12, 31))
+    t0 = time.perf_counter()
+    index = tracker.build_cadence_index(threads, store) if use_index else None
+    for th in threads:
+        for d in range(365):
+            tracker.is_day_fulfilled(th, date(year, 1, 1) + timedelta(days=d), store, index)
+    return time.perf_counter() - t0
+
+def bench_render(sizes=(10, 20, 40, 80)):
+    year = date.today().year
+    client = app.test_client()
+    print(f"{'threads':>8} {'render_s':>10} {'scan_s':>10} {'index_s':>10}")
+    for n in sizes:
+        with app.app_context():
+            seed(n, year, cadences=['yearly', 'quarterly'])
+            threads = Thread.query.all()
+            scan = time_fulfilment(threads, year, use_index=False)
+            indexed = time_fulfilment(threads, year, use_index=True)
+        render = time_render(client)
+        print(f"{n:>8} {render:>10.3f} {scan:>10.3f} {indexed:>10.3f}")
+
+def hot_queries():
+    d = date.today()
+    return {
+        'square store load': db.session.query(Square.thread_id, Square.period, Square.status, Square.chain_end_reason).filter(
+            Square.status.in_(('hit', 'miss')), Square.thread_id.in_([1, 2]), Square.period >= d, Square.period <= d),
+        'chain hit bound': db.session.query(func.max(Square.period)).filter(
+            Square.thread_id == 1, Square.status == 'hit', Square.period > d, Square.period < d),
+        'chain gap miss': Square.query.filter(Square.thread_id == 1, Square.status == 'miss',
+                                              Square.period > d, Square.period < d).order_by(Square.period).limit(1),
+        'chain hit count': db.session.query(func.count(Square.square_id)).filter(
+            Square.thread_id == 1, Square.status == 'hit', Square.period >= d, Square.period <= d),
+        'chain relink': Square.query.filter(Square.chain_id == 'CH_1_20240101', Square.period >= d),
+        'neighbour chains': Chain.query.filter(Chain.thread_id == 1, Chain.chain_start_date <= d).order_by(Chain.chain_start_date.desc()).limit(1),
+        'off routine days': Calendar.query.filter(Calendar.off_routine_flag == True, Calendar.actual_date >= d, Calendar.actual_date <= d),
+        'active threads': Thread.query.filter(Thread.status == 'active').order_by(Thread.rank.desc()),
+        'day comments': DayComment.query.filter_by(day=d).order_by(DayComment.id),
+        'period rollups': tracker.PeriodRollup.query.filter(tracker.PeriodRollup.thread_id.in_([1, 2]), tracker.PeriodRollup.period_end >= d,
+                                                             tracker.PeriodRollup.period_start <= d),
+        'board page': tracker.BoardItem.query.filter(tracker.BoardItem.id < 100).order_by(tracker.BoardItem.id.desc()).limit(21),
+    }
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_suite(sizes=((10, 1), (20, 3), (50, 5)), toggles=50, repeat=3):
+    # (threads, years) per run; everything is best-of-`repeat` seconds except toggle, which is the mean per request
+    client = app.test_client()
+    rnd = random.Random(7)
+    year = date.today().year
+    results = []
+    for n_threads, years in sizes:
+        row = {'threads': n_threads, 'years': years}
+        with app.app_context():
+            t0 = time.perf_counter()
+            row['squares'] = generate(n_threads, years=years, end_year=year)
+            row['seed_s'] = time.perf_counter() - t0
+        row['rollup_s'] = best_of(tracker.rollup_closed_periods, 1)
+
+        def render_cold():
+            tracker.invalidate_grid_cache()
+            time_render(client, repeat=1)
+        row['render_cold_s'] = best_of(render_cold, repeat)
+        row['render_warm_s'] = time_render(client, repeat)
+
+        with app.app_context(): mark = tracker.backup_mark()
+        t0 = time.perf_counter()
+        for _ in range(toggles):
+            d = date(year, 1, 1) + timedelta(days=rnd.randint(0, 364))
+            resp = client.post('/api/toggle_status', json={'thread_id': rnd.randint(1, n_threads), 'date': str(d),
+                                                           'status': rnd.choice(['hit', 'hit', 'miss', 'empty']), 'miss_reason': 'bench'})
+            assert resp.get_json()['success']
+        row['toggle_avg_s'] = (time.perf_counter() - t0) / toggles
+
+        with app.app_context():
+            backup = {}
+            def json_backup(): backup['json'] = tracker.create_full_backup_json().encode()
+            def stream_backup():
+                buf = io.BytesIO()
+                tracker.write_backup_stream(buf)
+                backup['ndjson'] = buf.getvalue()
+            row['backup_json_s'] = best_of(json_backup, repeat)
+            row['backup_ndjson_s'] = best_of(stream_backup, repeat)
+            def delta_backup():
+                buf = io.BytesIO()
+                tracker.write_backup_stream(buf, since=mark)
+                backup['delta'] = buf.getvalue()
+            row['backup_delta_s'] = best_of(delta_backup, repeat)
+            row['backup_json_bytes'] = len(backup['json'])
+            row['backup_delta_bytes'] = len(backup['delta'])
+            row['backup_ndjson_bytes'] = len(backup['ndjson'])
+            def restore(kind):
+                ok, msg = tracker.restore_from_json(backup[kind])
+                assert ok, msg
+            row['restore_json_s'] = best_of(lambda: restore('json'), 1)
+            row['restore_ndjson_s'] = best_of(lambda: restore('ndjson'), 1)
+        results.append(row)
+        print(" ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()), flush=True)
+    return results
+
+def git_revision():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: return None
+
+def write_results(results, path):
+    doc = {'revision': git_revision(), 'timestamp': datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(), 'platform': platform.platform(), 'results': results}
+    with open(path, 'w') as f: json.dump(doc, f, indent=2)
+    print(f"wrote {path}")
+
+def compare(old_path, new_path):
+    # ratios new/old for every timing present in both files, matched on (threads, years)
+    with open(old_path) as f: old = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    old_rows = {(r['threads'], r['years']): r for r in old['results']}
+    print(f"{old.get('revision')} -> {new.get('revision')}")
+    for row in new['results']:
+        base = old_rows.get((row['threads'], row['years']))
+        if not base: continue
+        for key, value in row.items():
+            if key.endswith('_s') and base.get(key):
+                ratio = value / base[key]
+                flag = '  SLOWER' if ratio > 1.2 else ''
+                print(f"{row['threads']:>4}x{row['years']}y {key:<18} {base[key]:>9.4f} -> {value:>9.4f}  x{ratio:.2f}{flag}")
+
+def stress(writers=8, ops=100, n_threads=3):
+    # parallel writers hammering a handful of squares and today's calendar row (created by the race itself);
+    # every request must succeed and the end state must be consistent
+    today = date.today()
+    days = [today - timedelta(days=i) for i in range(5)]
+    with app.app_context():
+        generate(n_threads, years=1, calendar=False)
+    context_posts = []
+    errors = []
+    def writer(i):
+        client = app.test_client()
+        rnd = random.Random(i)
+        for k in range(ops):
+            if rnd.random() < 0.7:
+                resp = client.post('/api/toggle_status', json={'thread_id': rnd.randint(1, n_threads), 'date': str(rnd.choice(days)),
+                                                               'status': rnd.choice(['hit', 'miss', 'empty']), 'miss_reason': f"w{i}"})
+            else:
+                resp = client.post('/api/update_day_context', json={'top_work': f"w{i}-{k}", 'meds': bool(k % 2), 'comments': f"w{i}-{k}"})
+                if resp.status_code == 200 and resp.get_json()['success']: context_posts.append(k)
+            if resp.status_code != 200 or not resp.get_json()['success']: errors.append((i, k, resp.status_code, resp.get_data(as_text=True)[:200]))
+    t0 = time.perf_counter()
+    pool = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in pool: t.start()
+    for t in pool: t.join()
+    elapsed = time.perf_counter() - t0
+    with app.app_context():
+        comments = DayComment.query.filter_by(day=today).count()
+        calendar_rows = Calendar.query.filter_by(actual_date=today).count()
+        version = db.session.get(Calendar, today).version
+        chains_ok = all(tracker.chains_match(t) for t in range(1, n_threads + 1))
+    print(f"{writers} writers x {ops} ops in {elapsed:.2f}s: {len(errors)} errors, {comments}/{len(context_posts)} comments, "
+          f"calendar rows {calendar_rows} (version {version}), chains {'ok' if chains_ok else 'BROKEN'}")
+    for e in errors[:5]: print("  ", e)
+    return not errors and comments == len(context_posts) and calendar_rows == 1 and chains_ok
+
+def check_query_plans():
+    # EXPLAIN QUERY PLAN (sqlite) for the hot paths; every step touching a table must go through an index
+    conn = db.session.connection()
+    failures = []
+    for name, query in hot_queries().items():
+        compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+        params = (None,) * len(compiled.positiontup or ())
+        plan = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params)]
+        ok = all('INDEX' in step or 'PRIMARY KEY' in step for step in plan if step.startswith(('SCAN', 'SEARCH')))
+        print(f"{'ok ' if ok else 'BAD'} {name}: {' | '.join(plan)}")
+        if not ok: failures.append(name)
+    return failures
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == 'plans':
+        with app.app_context():
+            sys.exit(1 if check_query_plans() else 0)
+    if args and args[0] == 'suite':
+        # python bench.py suite [out.json] [threads:years ...]
+        out = args[1] if len(args) > 1 and args[1].endswith('.json') else 'bench_results.json'
+        sizes = tuple(tuple(int(x) for x in a.split(':')) for a in args[1:] if ':' in a)
+        write_results(bench_suite(sizes or ((10, 1), (20, 3), (50, 5))), out)
+        sys.exit(0)
+    if args and args[0] == 'stress':
+        # python bench.py stress [writers] [ops]
+        sys.exit(0 if stress(*(int(a) for a in args[1:3])) else 1)
+    if args and args[0] == 'compare':
+        compare(args[1], args[2])
+        sys.exit(0)
+    if args and args[0] == 'render': args = args[1:]
+    sizes = tuple(int(a) for a in args) or (10, 20, 40, 80)
+    bench_render(sizes)
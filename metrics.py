@@ -0,0 +1,107 @@
+import threading
+import time
+import bisect
+from contextlib import contextmanager, nullcontext
+
+# Minimal in-process metrics registry rendered as Prometheus text. Everything is a counter or a
+# fixed-bucket histogram guarded by one lock, so an observation is a dict lookup + bisect.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+        self.local = threading.local()
+
+    def describe(self, name, kind, text, buckets=BUCKETS):
+        self.help[name] = (kind, text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.help.get(name, (None, None, BUCKETS))[2]
+        i = bisect.bisect_left(buckets, value)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None: h = self.histograms[key] = [[0] * (len(buckets) + 1), 0, 0.0]
+            h[0][i] += 1
+            h[1] += 1
+            h[2] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter() - t0, **labels)
+
+    # per-thread request scope: query counters for the request currently running on this thread
+    def begin(self):
+        self.local.queries = 0
+        self.local.query_time = 0.0
+        self.local.started = time.perf_counter()
+
+    def scope(self):
+        return getattr(self.local, 'started', None), getattr(self.local, 'queries', 0), getattr(self.local, 'query_time', 0.0)
+
+    def query(self, elapsed):
+        self.observe('db_query_duration_seconds', elapsed)
+        if getattr(self.local, 'started', None) is not None:
+            self.local.queries += 1
+            self.local.query_time += elapsed
+
+    def end(self):
+        self.local.started = None
+
+    def render(self, gauges=()):
+        # gauges: [(name, kind, help, value, labels dict)] read from other components at scrape time
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: ([*v[0]], v[1], v[2]) for k, v in self.histograms.items()}
+        out = []
+        seen = set()
+        def header(name, kind, text):
+            if name in seen: return
+            seen.add(name)
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter', self.help.get(name, ('', name))[1])
+            out.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), (counts, total, value_sum) in sorted(histograms.items()):
+            header(name, 'histogram', self.help.get(name, ('', name))[1])
+            buckets = self.help.get(name, (None, None, BUCKETS))[2]
+            running = 0
+            for le, c in zip(buckets, counts):
+                running += c
+                out.append(f"{name}_bucket{_labels(labels + (('le', repr(float(le))),))} {running}")
+            out.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {total}")
+            out.append(f"{name}_sum{_labels(labels)} {value_sum:.6f}")
+            out.append(f"{name}_count{_labels(labels)} {total}")
+        for name, kind, text, value, labels in gauges:
+            header(name, kind, text)
+            out.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(out) + "\n"
+
+def _labels(labels):
+    if not labels: return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+registry = Registry()
+registry.describe('http_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+registry.describe('http_request_queries', 'histogram', 'SQL statements issued per request.', COUNT_BUCKETS)
+registry.describe('db_query_duration_seconds', 'histogram', 'Duration of single SQL statements.')
+registry.describe('stage_duration_seconds', 'histogram', 'Time spent in named stages (squares load, grid build, render).')
+registry.describe('bot_update_duration_seconds', 'histogram', 'Telegram update handling time by command.')
+registry.describe('app_errors_total', 'counter', 'Exceptions caught by handlers.')
+
+ENABLED = False
+
+def stage(name):
+    return registry.timer('stage_duration_seconds', stage=name) if ENABLED else nullcontext()